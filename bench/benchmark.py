@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""Offline benchmark for dbus-lektrico-evcharger.py
+
+Runs the service against local charger/EM simulators with stand-ins for vedbus, dbus and GLib,
+drives _update and _handlechangedvalue directly and reports tick latency, throughput, request
+counts and memory. Example:
+
+    python bench/benchmark.py --ticks 500 --latency 20 --writes 50
+"""
+
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SCRIPT = os.path.join(ROOT_DIR, 'dbus-lektrico-evcharger.py')
+
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stubs
+from simulator import LektricoSimulator
+
+CONFIG_TEMPLATE = """[DEFAULT]
+AccessType=OnPremise
+SignOfLifeLog=0
+Deviceinstance=43
+HardwareVersion=1
+
+[ONPREMISE]
+Host=%(host)s
+EM_Host=%(em_host)s
+ConnectTimeout=%(timeout)s
+ReadTimeout=%(timeout)s
+Push=%(push)s
+StaticCache=
+
+[HISTORY]
+Path=
+
+[RECORD]
+Path=%(record)s
+"""
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def rssKb():
+    # current RSS if /proc is there, peak RSS otherwise
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def loadService(loop):
+    stubs.install(loop)
+    spec = importlib.util.spec_from_file_location('dbus_lektrico_evcharger', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(args):
+    script = None
+    if args.scenario:
+        with open(args.scenario) as f:
+            script = json.load(f)
+
+    charger = LektricoSimulator(latency=args.latency / 1000.0, jitter=args.jitter / 1000.0,
+                                timeout_rate=args.timeout_rate, hang_time=args.timeout * 2, script=script,
+                                push=args.push,
+                                pause_after=args.pause_after / 1000.0 if args.pause_after is not None else None).start()
+    em = LektricoSimulator(latency=args.latency / 1000.0, jitter=args.jitter / 1000.0).start()
+
+    workdir = tempfile.mkdtemp(prefix='lektrico-bench-')
+    configfile = os.path.join(workdir, 'config.ini')
+    with open(configfile, 'w') as f:
+        f.write(CONFIG_TEMPLATE % {'host': charger.host, 'em_host': em.host, 'timeout': args.timeout,
+                                   'push': 'on' if args.push else 'off', 'record': args.record or ''})
+
+    loop = stubs.FakeMainLoop(run_timers=False)
+    module = loadService(loop)
+
+    try:
+        rssBefore = rssKb()
+        hub = module.DbusLektricoHub('com.victronenergy.evcharger', module.getDbusPaths(), configfile=configfile)
+        service = list(hub.services.values())[0]
+        dbusservice = service._dbusservice
+
+        # the EM poll normally runs on its own timer, prime the cache once
+        hub._updateEM()
+        loop.run_until(lambda: not hub._em_fetch_in_progress)
+
+        startCounts = dict(charger.counts)
+        startSignals = dbusservice.signals
+
+        # poll ticks: from _update() until the snapshot is published on the main loop
+        tickLatencies = []
+        cpuStart = time.process_time()
+        wallStart = time.monotonic()
+        for i in range(args.ticks):
+            t0 = time.monotonic()
+            service._update()
+            loop.run_until(lambda: not service._fetch_in_progress, timeout=args.timeout * 3)
+            tickLatencies.append(time.monotonic() - t0)
+            if args.interval:
+                time.sleep(args.interval / 1000.0)
+        wallTicks = time.monotonic() - wallStart
+        cpuTicks = time.process_time() - cpuStart
+
+        tickRequests = sum(charger.counts.values()) - sum(startCounts.values())
+        tickSignals = dbusservice.signals - startSignals
+
+        # control writes: time spent in the D-Bus callback and until the charger confirmed the value,
+        # from here on the service polls on its own timers like it does on a GX
+        loop.run_timers = True
+        callbackLatencies = []
+        commandLatencies = []
+        rpcsBefore = len(charger.rpcs)
+        for i in range(args.writes):
+            value = 6 + i % 10
+            t0 = time.monotonic()
+            dbusservice.setFromDbus('/SetCurrent', value)
+            callbackLatencies.append(time.monotonic() - t0)
+            if not args.burst:
+                loop.run_until(lambda: not service._pendingCommands, timeout=args.timeout * 3)
+                commandLatencies.append(time.monotonic() - t0)
+        if args.burst:
+            t0 = time.monotonic()
+            loop.run_until(lambda: not service._pendingCommands, timeout=args.timeout * 3)
+            commandLatencies.append(time.monotonic() - t0)
+        writeRpcs = len(charger.rpcs) - rpcsBefore
+
+        # state changes (plug in/unplug): how long until /Status follows, and at what cost
+        changeLatencies = []
+        requestsBefore = charger.total_requests()
+        for i in range(args.state_changes):
+            state, status = ('B', 1) if i % 2 == 0 else ('A', 0)
+            loop.run_for(args.change_interval / 1000.0)
+            t0 = time.monotonic()
+            charger.update({'charger_state': state})
+            loop.run_until(lambda: dbusservice['/Status'] == status, timeout=args.timeout * 10)
+            changeLatencies.append(time.monotonic() - t0)
+        changeRequests = charger.total_requests() - requestsBefore
+
+        results = {
+            'ticks': args.ticks,
+            'ticks_per_sec': args.ticks / wallTicks if wallTicks else 0,
+            'tick_p50_ms': percentile(tickLatencies, 50) * 1000,
+            'tick_p99_ms': percentile(tickLatencies, 99) * 1000,
+            'tick_max_ms': max(tickLatencies or [0]) * 1000,
+            'cpu_ms_per_tick': cpuTicks / args.ticks * 1000 if args.ticks else 0,
+            'requests_per_tick': tickRequests / float(args.ticks) if args.ticks else 0,
+            'dbus_signals_per_tick': tickSignals / float(args.ticks) if args.ticks else 0,
+            'writes': args.writes,
+            'write_callback_p99_ms': percentile(callbackLatencies, 99) * 1000,
+            'write_done_p50_ms': percentile(commandLatencies, 50) * 1000,
+            'write_done_p99_ms': percentile(commandLatencies, 99) * 1000,
+            'write_rpcs': writeRpcs,
+            'push': args.push,
+            'state_changes': args.state_changes,
+            'state_change_p50_ms': percentile(changeLatencies, 50) * 1000,
+            'state_change_max_ms': max(changeLatencies or [0]) * 1000,
+            'requests_per_state_change': changeRequests / float(args.state_changes) if args.state_changes else 0,
+            'rpc_counts': charger.counts,
+            'rss_kb': rssKb(),
+            'rss_growth_kb': rssKb() - rssBefore,
+        }
+        if hub.recorder is not None:
+            hub.recorder.close()
+    finally:
+        charger.stop()
+        em.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Lektri.co D-Bus service against a local simulator')
+    parser.add_argument('--ticks', type=int, default=200, help='number of poll ticks to run')
+    parser.add_argument('--interval', type=float, default=0, help='pause between ticks in ms')
+    parser.add_argument('--latency', type=float, default=0, help='simulated charger/EM response time in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random +/- spread of the response time in ms')
+    parser.add_argument('--timeout-rate', type=float, default=0, help='share of charger requests that hang (0..1)')
+    parser.add_argument('--timeout', type=float, default=2, help='ConnectTimeout/ReadTimeout of the service in s')
+    parser.add_argument('--scenario', help='JSON state script for the charger, see bench/scenarios')
+    parser.add_argument('--writes', type=int, default=20, help='number of /SetCurrent writes')
+    parser.add_argument('--burst', action='store_true', help='send the writes back to back instead of one by one')
+    parser.add_argument('--push', action='store_true', help='simulate firmware that pushes charger_info over a websocket')
+    parser.add_argument('--pause-after', type=float,
+                        help='simulate a charger that pauses this many ms after a current change while charging')
+    parser.add_argument('--state-changes', type=int, default=0, help='number of plug in/unplug events to time')
+    parser.add_argument('--change-interval', type=float, default=2000, help='time between state changes in ms')
+    parser.add_argument('--record', help='record the traffic to this file, for bench/replay.py')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the service log')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        level=logging.INFO if args.verbose else logging.CRITICAL + 1)
+
+    results = run(args)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    for key in sorted(results):
+        value = results[key]
+        print("%-24s %s" % (key, "%.2f" % value if isinstance(value, float) else value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+"""Replay a recording (config.ini [RECORD] Path) into dbus-lektrico-evcharger.py without network or GX
+
+Every recorded charger_info/app_config answer becomes one poll tick and every recorded D-Bus write
+is sent again. Timeouts, rate limits and caches run on a clock that follows the recording, so
+waits end when the recording got that far, not in real time. The RPCs the service sends now are compared
+with the recorded ones, and --trace writes the feedback-loop guards after every event, so two
+versions of the service can be compared with diff. Example:
+
+    python bench/replay.py record.jsonl --speed 60 --trace trace.jsonl
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import stubs
+from benchmark import loadService, percentile, rssKb
+
+CONFIG_TEMPLATE = """[DEFAULT]
+AccessType=OnPremise
+SignOfLifeLog=0
+Deviceinstance=43
+HardwareVersion=1
+
+[ONPREMISE]
+EM_Host=%(em_host)s
+CommandTimeout=%(command_timeout)s
+CurrentWriteInterval=%(current_write_interval)s
+Push=off
+StaticCache=
+
+[HISTORY]
+Path=
+"""
+
+# seconds between D-Bus writes that are replayed as one burst
+BURST_GAP = 0.01
+
+CHARGER_TEMPLATE = """
+[CHARGER:%(name)s]
+Host=%(host)s
+Deviceinstance=%(deviceinstance)s
+Phases=%(phases)s
+"""
+
+
+def writeConfig(configfile, recorded):
+    values = {
+        'em_host': recorded['em_host'],
+        'command_timeout': recorded.get('command_timeout', 10),
+        'current_write_interval': recorded.get('current_write_interval', 1),
+    }
+    with open(configfile, 'w') as f:
+        f.write(CONFIG_TEMPLATE % values)
+        for name, charger in recorded['chargers'].items():
+            f.write(CHARGER_TEMPLATE % {'name': name, 'host': charger['host'],
+                                        'deviceinstance': charger.get('deviceinstance') or 43,
+                                        'phases': charger.get('phases') or 'auto'})
+
+
+def guards(service, clock):
+    dbusservice = service._dbusservice
+    since = clock.time() - service._last_user_start_stop_time if service._last_user_start_stop_time else None
+    return {
+        'updating': service._updating,
+        'restarting': bool(service._restarting_after_change),
+        'since_user_start_stop': round(since, 3) if since is not None else None,
+        'pending': sorted(service._pendingCommands),
+        'StartStop': dbusservice['/StartStop'],
+        'SetCurrent': dbusservice['/SetCurrent'],
+        'Mode': dbusservice['/Mode'],
+        'Status': dbusservice['/Status'],
+    }
+
+
+def settle(loop, hub, clock):
+    # wake every thread waiting on the clock, then wait until each one is done or waits again
+    clock.advance()
+    busy = lambda: sum(1 for service in hub.services.values() if service._pendingCommands)
+    end = time.monotonic() + 30
+    while not (clock.settled() and clock.waiting() >= busy()) and time.monotonic() < end:
+        loop.iterate(0.001)
+
+
+def rpcCall(payload):
+    # (method, params) of an RPC, ids and src don't matter
+    return (payload.get('method'), json.dumps(payload.get('params'), sort_keys=True))
+
+
+def replaySegment(args, loop, module, header, events, workdir, stats, trace):
+    # one start of the service: its own config, hub and clock, nothing carries over from the start before
+    from lektrico import ReplayClock, ReplayTransport, RpcClient
+
+    configfile = os.path.join(workdir, 'config.ini')
+    writeConfig(configfile, header['config'])
+
+    # the service and everything it hands the hub's clock to follow the recording
+    start = events[0][0]
+    clock = ReplayClock(start)
+    hub = module.DbusLektricoHub('com.victronenergy.evcharger', module.getDbusPaths(), configfile=configfile,
+                                 clock=clock)
+    config = hub.config
+
+    # same chargers, but every request is answered from the recording
+    transport = ReplayTransport(events, health=config.health, clock=clock)
+    hub.transport = transport
+    hub.rpc = RpcClient(transport)
+    byStatusUrl = {}
+    configUrls = set()
+    for name, service in hub.services.items():
+        service._transport = transport
+        service._rpc = hub.rpc
+        byStatusUrl[config.charger(name).status_url] = service
+        configUrls.add(config.charger(name).config_url)
+
+    counts = stats['counts']
+    recordedRpcs = []
+    sentBefore = 0
+    wallStart = time.monotonic()
+    replayed = set()  # writes sent along with an earlier one of the same burst
+    for index, (t, kind, where, data, extra) in enumerate(events):
+        # recorded answers up to here go out, e.g. the charge.start the command thread is sending
+        clock.advance(t)
+        transport.replaying(index)
+        settle(loop, hub, clock)
+        if index in transport.taken or index in replayed:
+            continue  # already answered a GET outside a poll, e.g. the EM read back after a mode change
+        if args.speed:
+            delay = wallStart + (t - start) / args.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        entry = None
+        service = None
+        if kind in ('g', 'e'):
+            transport.serve(where, index)
+            transport.polling = True
+            service = byStatusUrl.get(where)
+            if service is not None:
+                counts['ticks'] += 1
+                counts['errors'] += kind == 'e'
+                counts['ticks_restarting'] += bool(service._restarting_after_change)
+                t0 = time.monotonic()
+                service._update()
+                loop.run_until(lambda: not service._fetch_in_progress)
+                stats['tick_latencies'].append(time.monotonic() - t0)
+                entry = {'event': 'tick', 'charger': service._name, 'error': data if kind == 'e' else None}
+            elif where == config.em_status_url:
+                counts['em_ticks'] += 1
+                hub._updateEM()
+                loop.run_until(lambda: not hub._em_fetch_in_progress)
+                entry = {'event': 'em'}
+            elif where not in configUrls:
+                counts['skipped'] += 1  # a host this start of the service doesn't know
+            transport.polling = False
+
+        elif kind == 'w':
+            service = hub.services.get(extra)
+            if service is None:
+                continue
+            # writes that came in back to back are all queued before the command thread may start one,
+            # like when recording (the file doesn't say when the thread picked up the first one)
+            burst = [index]
+            for later in range(index + 1, len(events)):
+                previous = events[burst[-1]][0]
+                if events[later][1] != 'w' or events[later][4] != extra or events[later][0] - previous > BURST_GAP:
+                    break
+                burst.append(later)
+            replayed.update(burst)
+            writes = []
+            with service._commands._cond:
+                for _, _, path, value, _ in (events[i] for i in burst):
+                    counts['writes'] += 1
+                    ignored = service._updating
+                    counts['writes_ignored'] += ignored
+                    service._dbusservice.setFromDbus(path, value)
+                    writes.append({'path': path, 'value': value, 'ignored': ignored})
+            entry = {'event': 'write', 'charger': extra, 'writes': writes}
+
+        elif kind == 'p':
+            recordedRpcs.append(rpcCall(data))
+
+        loop.iterate(0)
+        # let the command threads send their RPCs before the next snapshot comes in
+        settle(loop, hub, clock)
+        if trace is not None and entry is not None:
+            sent = transport.sent[sentBefore:]
+            sentBefore = len(transport.sent)
+            entry['segment'] = stats['segments']
+            entry['t'] = round(t - start, 3)
+            entry['sent'] = [payload.get('method') for url, payload in sent]
+            if service is not None:
+                entry.update(guards(service, clock))
+            trace.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    # commands still waiting for a confirmation, no more snapshots come so they time out on the replayed clock
+    transport.replaying(len(events))
+    end = clock.now + config.command_timeout
+    while any(service._pendingCommands for service in hub.services.values()) and clock.now < end:
+        clock.advance(clock.now + 0.1)
+        settle(loop, hub, clock)
+
+    replayedRpcs = [rpcCall(payload) for url, payload in transport.sent]
+    stats['rpcs_recorded'] += len(recordedRpcs)
+    stats['rpcs_replayed'] += len(replayedRpcs)
+    stats['rpc_mismatches'] += sum(1 for a, b in zip(recordedRpcs, replayedRpcs) if a != b)
+    stats['rpc_mismatches'] += abs(len(recordedRpcs) - len(replayedRpcs))
+    stats['recorded_s'] += events[-1][0] - start
+    stats['events'] += len(events)
+    stats['segments'] += 1
+
+
+def run(args):
+    loop = stubs.FakeMainLoop(run_timers=False)
+    module = loadService(loop)
+    # only importable once the stand-ins for dbus are installed
+    from lektrico import load_recording
+
+    # every start of the service (restart, reboot) begins a segment with its own header
+    segments = [(header, events) for header, events in load_recording(args.recording) if events]
+    if not segments:
+        raise SystemExit("%s holds no recorded events" % (args.recording))
+
+    workdir = tempfile.mkdtemp(prefix='lektrico-replay-')
+    trace = open(args.trace, 'w') if args.trace else None
+    stats = {
+        'counts': {'ticks': 0, 'em_ticks': 0, 'errors': 0, 'writes': 0, 'writes_ignored': 0, 'ticks_restarting': 0,
+                   'skipped': 0},
+        'tick_latencies': [], 'segments': 0, 'events': 0, 'recorded_s': 0.0,
+        'rpcs_recorded': 0, 'rpcs_replayed': 0, 'rpc_mismatches': 0,
+    }
+    try:
+        cpuStart = time.process_time()
+        wallStart = time.monotonic()
+        for header, events in segments:
+            replaySegment(args, loop, module, header, events, workdir, stats, trace)
+        wall = time.monotonic() - wallStart
+        cpu = time.process_time() - cpuStart
+    finally:
+        if trace is not None:
+            trace.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    counts = stats['counts']
+    results = dict(counts)
+    results.update({
+        'segments': stats['segments'],
+        'events': stats['events'],
+        'recorded_s': stats['recorded_s'],
+        'replay_s': wall,
+        'speedup': stats['recorded_s'] / wall if wall else 0,
+        'cpu_ms_per_tick': cpu / counts['ticks'] * 1000 if counts['ticks'] else 0,
+        'tick_p50_ms': percentile(stats['tick_latencies'], 50) * 1000,
+        'tick_p99_ms': percentile(stats['tick_latencies'], 99) * 1000,
+        'rpcs_recorded': stats['rpcs_recorded'],
+        'rpcs_replayed': stats['rpcs_replayed'],
+        'rpc_mismatches': stats['rpc_mismatches'],
+        'rss_kb': rssKb(),
+    })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded charger traffic into the Lektri.co D-Bus service')
+    parser.add_argument('recording', help='file written with config.ini [RECORD] Path')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='1 replays in real time, 60 one minute per second, 0 (default) as fast as possible')
+    parser.add_argument('--trace', help='write the guards and D-Bus values after every event to this file')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the service log')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s',
+                        level=logging.INFO if args.verbose else logging.CRITICAL + 1)
+
+    results = run(args)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    for key in sorted(results):
+        value = results[key]
+        print("%-24s %s" % (key, "%.2f" % value if isinstance(value, float) else value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Local stand-in for a Lektri.co station / EM web server, for benchmarks without hardware"""
+
+import base64
+import copy
+import hashlib
+import json
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'docs')
+
+
+def loadSample(name):
+    with open(os.path.join(DOCS_DIR, name)) as f:
+        return json.load(f)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LektricoSimulator:
+    """Serves charger_info/charger_config/app_config and the /rpc endpoint of one device
+
+    latency and jitter are in seconds, timeout_rate is the share of requests that hang for hang_time
+    seconds (longer than the service's ReadTimeout) to simulate a charger dropping off Wi-Fi.
+    script is a list of [seconds since start, {charger_info changes}] steps, see scenarios/.
+    With push set, a websocket on /rpc answers charger_info.get and sends NotifyStatus with every
+    charger_info change, like firmware with a push channel. Without it /rpc only takes POSTs.
+    Setting push_hung keeps open websockets connected but silent, like a charger that hung.
+    With pause_after set, charging pauses (state B) that many seconds after a dynamic_current.set.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, timeout_rate=0.0, hang_time=10.0, script=None,
+                 charger_info=None, app_config=None, host='127.0.0.1', port=0, push=False, pause_after=None):
+        self.push = push
+        self.pause_after = pause_after
+        self.push_hung = False
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.hang_time = hang_time
+        self.charger_info = copy.deepcopy(charger_info or loadSample('charger_info-sample.json'))
+        self.app_config = copy.deepcopy(app_config or loadSample('app_config-sample.json'))
+        self.charger_config = {'serial_number': '500006', 'fw_version': self.charger_info['fw_version']}
+        self._script = sorted(script or [], key=lambda step: step[0])
+        self._started = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        self.counts = {}  # endpoint/method -> number of requests
+        self.rpcs = []  # every POST body, in order
+
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the charger
+            disable_nagle_algorithm = True  # headers and body are written separately
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/rpc' and self.headers.get('Upgrade', '').lower() == 'websocket' and simulator.push:
+                    return simulator._websocket(self)
+                simulator._handle(self, 'GET', self.path, None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                simulator._handle(self, 'POST', self.path, json.loads(self.rfile.read(length)))
+
+        self._server = _Server((host, port), Handler)
+        self._thread = None
+
+    @property
+    def host(self):
+        return "%s:%d" % self._server.server_address[:2]
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='lektrico-simulator')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._server.shutdown()
+        self._server.server_close()
+
+    def total_requests(self):
+        return sum(self.counts.values())
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def update(self, changes):
+        """Change charger_info now, e.g. {'charger_state': 'B'} for a car plugging in"""
+        with self._lock:
+            self.charger_info.update(changes)
+
+    def _applyScript(self):
+        elapsed = time.monotonic() - self._started
+        with self._lock:
+            while self._script and self._script[0][0] <= elapsed:
+                self.charger_info.update(self._script.pop(0)[1])
+
+    def _handle(self, handler, method, path, body):
+        self._applyScript()
+
+        if random.random() < self.timeout_rate:
+            time.sleep(self.hang_time)
+        elif self.latency or self.jitter:
+            time.sleep(max(0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if method == 'GET':
+            self._count(path)
+            if path == '/rpc/charger_info.get':
+                return self._reply(handler, self.charger_info)
+            if path == '/rpc/charger_config.get':
+                return self._reply(handler, self.charger_config)
+            if path == '/rpc/app_config.get':
+                return self._reply(handler, self.app_config)
+            return self._reply(handler, {'error': 'unknown endpoint'}, status=404)
+
+        if path != '/rpc':
+            self._count(path)
+            return self._reply(handler, {'error': 'unknown endpoint'}, status=404)
+
+        self._count(body.get('method'))
+        with self._lock:
+            self.rpcs.append(body)
+        return self._reply(handler, {'id': body.get('id'), 'result': self._rpc(body.get('method'), body.get('params') or {})})
+
+    def _rpc(self, method, params):
+        with self._lock:
+            if method == 'charge.start':
+                self.charger_info['charger_state'] = 'C'
+            elif method == 'charge.stop':
+                self.charger_info['charger_state'] = 'B'
+            elif method == 'dynamic_current.set':
+                self.charger_info['dynamic_current'] = params['dynamic_current']
+                if self.pause_after is not None and self.charger_info['charger_state'] in ('C', 'D'):
+                    pause = threading.Timer(self.pause_after, self.update, [{'charger_state': 'B'}])
+                    pause.daemon = True
+                    pause.start()
+            elif method == 'app_config.set':
+                self.app_config[params['config_key']] = params['config_value']
+            else:
+                return False
+        return True
+
+    def _reply(self, handler, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _websocket(self, handler):
+        # RFC 6455 server side, just enough for JSON-RPC requests and NotifyStatus frames
+        key = handler.headers['Sec-WebSocket-Key']
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        handler.send_response(101)
+        handler.send_header('Upgrade', 'websocket')
+        handler.send_header('Connection', 'Upgrade')
+        handler.send_header('Sec-WebSocket-Accept', accept)
+        handler.end_headers()
+        handler.wfile.flush()
+        handler.close_connection = True
+        self._count('websocket')
+
+        sock = handler.connection
+        sock.settimeout(0.01)
+        buffer = b''
+        sent = None  # charger_info as the client knows it
+
+        while not self._stopped:
+            self._applyScript()
+            with self._lock:
+                if sent is not None and self.charger_info != sent and not self.push_hung:
+                    changes = dict((k, v) for k, v in self.charger_info.items() if sent.get(k) != v)
+                    sent = copy.deepcopy(self.charger_info)
+                    self._sendFrame(sock, {'src': 'simulator', 'method': 'NotifyStatus', 'params': changes})
+
+            try:
+                chunk = sock.recv(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+
+            while True:
+                frame, buffer = self._parseFrame(buffer)
+                if frame is None:
+                    break
+                opcode, payload = frame
+                if opcode == 0x8:
+                    return
+                if opcode != 0x1:
+                    continue
+                request = json.loads(payload.decode('utf-8'))
+                self._count('ws:' + request.get('method', ''))
+                if request.get('method') == 'charger_info.get' and not self.push_hung:
+                    with self._lock:
+                        sent = copy.deepcopy(self.charger_info)
+                    self._sendFrame(sock, {'id': request.get('id'), 'result': sent})
+
+    def _parseFrame(self, buffer):
+        # (opcode, payload) of the first complete client frame, or None
+        if len(buffer) < 2:
+            return None, buffer
+        length = buffer[1] & 0x7F
+        offset = 2
+        if length == 126:
+            if len(buffer) < 4:
+                return None, buffer
+            length = struct.unpack('>H', buffer[2:4])[0]
+            offset = 4
+        elif length == 127:
+            if len(buffer) < 10:
+                return None, buffer
+            length = struct.unpack('>Q', buffer[2:10])[0]
+            offset = 10
+        if len(buffer) < offset + 4 + length:
+            return None, buffer
+        mask = buffer[offset:offset + 4]
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(buffer[offset + 4:offset + 4 + length]))
+        return (buffer[0] & 0x0F, payload), buffer[offset + 4 + length:]
+
+    def _sendFrame(self, sock, message):
+        payload = json.dumps(message).encode('utf-8')
+        if len(payload) < 126:
+            header = struct.pack('>BB', 0x81, len(payload))
+        else:
+            header = struct.pack('>BBH', 0x81, 126, len(payload))
+        sock.sendall(header + payload)
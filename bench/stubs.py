@@ -0,0 +1,194 @@
+"""Stand-ins for vedbus, dbus and GLib so the service can run without a GX device"""
+
+import sys
+import threading
+import time
+import types
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class FakeVeDbusService:
+    """Same interface as velib_python's VeDbusService, values live in a dict and writes are counted"""
+
+    def __init__(self, servicename, bus=None, register=True):
+        self.servicename = servicename
+        self._values = {}
+        self._callbacks = {}
+        self._textcallbacks = {}
+        self.writes = 0  # local __setitem__ calls
+        self.signals = 0  # writes that changed a value, i.e. PropertiesChanged a real service would send
+
+    def add_path(self, path, value, description="", writeable=False, onchangecallback=None,
+                 gettextcallback=None, valuetype=None, itemtype=None):
+        self._values[path] = value
+        self._callbacks[path] = onchangecallback
+        self._textcallbacks[path] = gettextcallback
+
+    def register(self):
+        pass
+
+    def __getitem__(self, path):
+        return self._values[path]
+
+    def __setitem__(self, path, value):
+        self.writes += 1
+        if self._values.get(path) != value:
+            self.signals += 1
+        self._values[path] = value
+
+    def __delitem__(self, path):
+        del self._values[path]
+
+    def __contains__(self, path):
+        return path in self._values
+
+    def setFromDbus(self, path, value):
+        """Simulate a SetValue from VRM/GX: run the onchange callback and store the value if accepted"""
+        callback = self._callbacks.get(path)
+        if callback is not None and not callback(path, value):
+            return False
+        self[path] = value
+        return True
+
+    def getText(self, path):
+        callback = self._textcallbacks.get(path)
+        return callback(path, self._values[path]) if callback else str(self._values[path])
+
+
+class FakeMainLoop:
+    """Minimal GLib replacement: idle callbacks from any thread, timers only when asked for"""
+
+    PRIORITY_DEFAULT = 0
+    PRIORITY_HIGH = -100
+
+    def __init__(self, run_timers=False):
+        self.run_timers = run_timers
+        self._idle = queue.Queue()
+        self._timers = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _add(self, seconds, callback, args):
+        with self._lock:
+            source = self._next_id
+            self._next_id += 1
+            self._timers[source] = [time.monotonic() + seconds, seconds, callback, args]
+        return source
+
+    def idle_add(self, callback, *args):
+        self._idle.put((callback, args))
+        return 0
+
+    def timeout_add(self, ms, callback, *args):
+        return self._add(ms / 1000.0, callback, args)
+
+    def timeout_add_seconds(self, seconds, callback, *args):
+        return self._add(seconds, callback, args)
+
+    def unix_signal_add(self, priority, signum, callback, *args):
+        return 0
+
+    def source_remove(self, source):
+        with self._lock:
+            self._timers.pop(source, None)
+
+    def pending_timers(self):
+        return len(self._timers)
+
+    def iterate(self, timeout=0.01):
+        """Run idle callbacks (waiting up to timeout for the first) and due timers once"""
+        ran = 0
+        try:
+            callback, args = self._idle.get(timeout=timeout)
+            while True:
+                if callback(*args):
+                    self._idle.put((callback, args))
+                ran += 1
+                callback, args = self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        if self.run_timers:
+            now = time.monotonic()
+            with self._lock:
+                due = [(source, timer) for source, timer in self._timers.items() if timer[0] <= now]
+            for source, timer in due:
+                with self._lock:
+                    if source not in self._timers:
+                        continue
+                    del self._timers[source]
+                if timer[2](*timer[3]):
+                    with self._lock:
+                        timer[0] = time.monotonic() + timer[1]
+                        self._timers[source] = timer
+                ran += 1
+        return ran
+
+    def run_until(self, condition, timeout=30.0):
+        end = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > end:
+                return False
+            self.iterate()
+        return True
+
+    def run_for(self, seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            self.iterate()
+
+    def MainLoop(self):
+        loop = self
+        return types.SimpleNamespace(run=lambda: loop.run_until(lambda: False, timeout=float('inf')),
+                                     quit=lambda: None)
+
+
+class _FakeBus:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def add_signal_receiver(self, *args, **kwargs):
+        pass
+
+    def get_object(self, *args, **kwargs):
+        raise RuntimeError("no D-Bus in benchmark")
+
+    def get_unix_process_id(self, sender):
+        return 0
+
+
+def install(loop):
+    """Register the stand-ins in sys.modules, must run before the service script is imported"""
+    vedbus = types.ModuleType('vedbus')
+    vedbus.VeDbusService = FakeVeDbusService
+
+    dbus = types.ModuleType('dbus')
+    dbus.SystemBus = _FakeBus
+    dbus.SessionBus = _FakeBus
+    dbus.Interface = lambda *args, **kwargs: None
+    dbus.lowlevel = types.ModuleType('dbus.lowlevel')
+    dbus.lowlevel.get_calling_message = lambda: None
+    dbus.exceptions = types.ModuleType('dbus.exceptions')
+    dbus.exceptions.DBusException = Exception
+    dbus.mainloop = types.ModuleType('dbus.mainloop')
+    dbus.mainloop.glib = types.ModuleType('dbus.mainloop.glib')
+    dbus.mainloop.glib.DBusGMainLoop = lambda set_as_default=False: None
+
+    gi = types.ModuleType('gi')
+    gi.repository = types.ModuleType('gi.repository')
+    gi.repository.GLib = loop
+
+    sys.modules.update({
+        'vedbus': vedbus,
+        'dbus': dbus,
+        'dbus.lowlevel': dbus.lowlevel,
+        'dbus.exceptions': dbus.exceptions,
+        'dbus.mainloop': dbus.mainloop,
+        'dbus.mainloop.glib': dbus.mainloop.glib,
+        'gi': gi,
+        'gi.repository': gi.repository,
+    })
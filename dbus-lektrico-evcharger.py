@@ -4,10 +4,8 @@ import platform
 import logging
 import sys
 import os
-import time
 import requests
-import configparser
-import random
+import signal
 import dbus
 import traceback
 
@@ -15,38 +13,158 @@ import traceback
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), '/opt/victronenergy/dbus-systemcalc-py/ext/velib_python'))
 from vedbus import VeDbusService
 
+from lektrico import (OFFLINE, SYSTEM_CLOCK, Command, CommandQueue, DbusSenderCache, DiffPublisher, FetchEngine, Field, FileCache,
+                      HttpTransport, LektricoConfig, Metrics, PollScheduler, PushChannel, PushNotSupported, Recorder,
+                      RpcClient, SessionHistory, SnapshotWaiter, SurplusController, SystemValues, TTLCache, compile_fields,
+                      deadbands, detect_phases, phase_values, setup_logging)
+
 if sys.version_info.major == 2:
     import gobject
 else:
     from gi.repository import GLib as gobject
 
 
+# RPC types with latency/error stats under /Debug/Rpc/<name>
+RPC_NAMES = ['charger_info', 'charger_config', 'app_config', 'dynamic_current.set', 'charge.start', 'charge.stop',
+             'app_config.set']
+# the ones that go to the EM, shared by all chargers and only shown on the first one
+EM_RPC_NAMES = ['app_config', 'app_config.set']
+
+# how often the /Debug paths are refreshed
+DEBUG_INTERVAL = 10
+
+PHASES = ('L1', 'L2', 'L3')
+
+# Victron /Mode -> Lektrico load_balancing_mode and back
+MODE_TO_LEKTRICO = {0: 1, 1: 3, 2: 2}  # Manual→Green, Auto→Hybrid, Scheduled→Power
+MODE_FROM_LEKTRICO = {'3': 1, '1': 0, '2': 2}  # Green→Auto, Power→Manual, Hybrid→Scheduled
+
+# D-Bus paths filled from charger_info. Paths with a key are converted by one function compiled at
+# startup, the others are filled in _applySnapshot. Deadbands can be overridden in [DEADBANDS].
+CHARGER_FIELDS = [
+    Field('/Ac/Power', 'instant_power', int, fmt='%.0fW', deadband=5),
+    Field('/Ac/L1/Power', fmt='%.0fW', deadband=5),
+    Field('/Ac/L2/Power', fmt='%.0fW', deadband=5),
+    Field('/Ac/L3/Power', fmt='%.0fW', deadband=5),
+    Field('/Ac/L1/Current', fmt='%.1fA'),
+    Field('/Ac/L2/Current', fmt='%.1fA'),
+    Field('/Ac/L3/Current', fmt='%.1fA'),
+    Field('/Ac/L1/Voltage', fmt='%.0fV'),
+    Field('/Ac/L2/Voltage', fmt='%.0fV'),
+    Field('/Ac/L3/Voltage', fmt='%.0fV'),
+    Field('/Ac/Energy/Forward', 'total_charged_energy', float, fmt='%.2fkWh'),
+    Field('/Session/Energy', 'session_energy', float, scale=0.001, fmt='%.2fkWh'),
+    Field('/ChargingTime', 'charging_time', int, fmt='%ds'),
+    Field('/Ac/Voltage', 'voltage', int, fmt='%.0fV', deadband=0.5),
+    Field('/Current', 'current', int, fmt='%.1fA'),
+    Field('/SetCurrent', 'dynamic_current', int, fmt='%.0fA'),
+    Field('/MaxCurrent', 'dynamic_current', int, fmt='%.0fA'),
+    Field('/MCU/Temperature', 'temperature', int, fmt='%d°C'),
+    Field('/StartStop'),
+    Field('/Mode'),
+    Field('/Status', 'charger_state', mapping={'A': 0, 'B': 1, 'C': 2, 'D': 3}, default=0, initial=None,
+          writeable=False),
+
+    # newer firmware only
+    Field('/EmCurrent', 'em_current', int, fmt='%.0fA', required=False, initial=None, writeable=False),
+    Field('/PwmCurrent', 'pwm_current', int, fmt='%.0fA', required=False, initial=None, writeable=False),
+    Field('/CurrentLimitReason', 'current_limit_reason', int, required=False, initial=None, writeable=False),
+    Field('/HasActiveErrors', 'has_active_errors', int, required=False, initial=None, writeable=False),
+]
+
+# seconds a change waits for a charger_info that confirms it
+CONFIRM_TIMEOUT = 5
+
+# seconds a change that was applied while charging is watched for the pause it may cause
+PAUSE_WINDOW = 2
+
+# seconds before a failed push channel is opened again, polling runs in between
+PUSH_RETRY = 60
+
+# readings that are zeroed while the charger is offline
+LIVE_PATHS = ['/Ac/Power', '/Ac/L1/Power', '/Ac/L2/Power', '/Ac/L3/Power', '/Ac/L1/Current', '/Ac/L2/Current',
+              '/Ac/L3/Current', '/Current']
+
+
+def logError(name, e):
+    # unreachable hosts are tracked by the circuit breaker, only unexpected errors need a traceback,
+    # the log thread writes it once per RepeatWindow when the same error comes back every tick
+    if isinstance(e, requests.exceptions.RequestException):
+        logging.debug("Error fetching %s data: %s" % (name, e))
+    else:
+        logging.error('Error fetching %s data' % name, exc_info=e)
+
+
+def parseFirmware(fw_version):
+    # '1.47' -> 147 for /FirmwareVersion, None for missing or odd versions like '1.47-rc1'
+    try:
+        return int(fw_version.replace('.', ''))
+    except (AttributeError, ValueError):
+        return None
+
+
 class DbusLektricoService:
-    def __init__(self, servicename, paths, productname='Lektri.co 1p7k', connection='Lektri.co HTTP JSON service'):
+    def __init__(self, hub, name, servicename, paths, productname='Lektri.co 1p7k', connection='Lektri.co HTTP JSON service'):
+        # config, HTTP sessions, scheduler and the EM poll are shared by all chargers of this process
+        self._hub = hub
+        self._name = name
         config = self._getConfig()
-        deviceinstance = int(config['DEFAULT']['Deviceinstance'])
-        hardwareVersion = int(config['DEFAULT']['HardwareVersion'])
-
-        self._dbusservice = VeDbusService("{}.http_{:02d}".format(servicename, deviceinstance), register=False)
+        self._chargerConfig = config.charger(name)
+        chargerConfig = self._getChargerConfig()
+        deviceinstance = chargerConfig.device_instance
+        hardwareVersion = chargerConfig.hardware_version
+
+        # every service needs its own bus connection when several chargers share this process
+        bus = dbus.SystemBus(private=True) if len(config.chargers) > 1 else None
+        self._dbusservice = VeDbusService("{}.http_{:02d}".format(servicename, deviceinstance), bus=bus, register=False)
         self._paths = paths
         self._updating = False  # Flag to prevent feedback loops during state updates
         self._last_start_stop_from_charger = None  # Track last value read from charger
         self._last_set_current_from_charger = None  # Track last current value read from charger
         self._last_mode_from_charger = None  # Track last mode value read from charger
-        self._restarting_after_change = False  # Flag to prevent stop commands during auto-restart
+        self._restarting_after_change = set()  # queued changes that may pause charging and restart it
         self._last_user_start_stop_command = None  # Track last command sent by user
         self._last_user_start_stop_time = 0  # Track when last user command was sent
+        self._fetch_in_progress = False  # Flag to skip ticks while the previous fetch is still running
+        self._pendingCommands = {}  # path -> number of writes still queued or running for it
+        self._phases = chargerConfig.phases  # 1, 3 or None until detected
+
+        self._transport = hub.transport
+        self._scheduler = hub.scheduler
+        self._emCache = hub.emCache
+        self._fetchEngine = hub.fetchEngine
+        self._rpc = hub.rpc
+        self._clock = hub.clock
+        self._snapshots = SnapshotWaiter(clock=self._clock)  # lets writes wait for the charger to confirm them
+        self._staticCache = hub.staticCache
+        self._static = self._staticCache.get(name) or {}  # firmware/serial, from the last run until the charger answers
+        self._staticFetched = False  # charger_config was read in this run
+        self._push = None  # PushChannel while we try to get charger_info pushed
+        self._pushActive = False  # the push channel delivers, polling only now and then
+        self._pushFirmware = None  # fw_version the push channel was tried with
+        self._pushRetryTimer = None
+        self._updateTimer = None
+        self._updateDue = None  # (monotonic time the next tick should run, interval) to detect missed ticks
+        self._pollStart = None
+
+        # poll/D-Bus stats of this charger, the RPC stats are kept by the shared transport
+        self._metrics = Metrics()
+        self._lastDebugTime = self._clock.monotonic()
+        self._lastDbusWrites = 0
+        self._dbusWritesPerSecond = 0.0
+
+        # optional solar surplus control, one step per poll while /Mode is Auto
+        self._surplus = SurplusController(**config.surplus)
+
+        # power/current/energy of every tick, kept per session in a fixed-size file under /data
+        self._history = self._openHistory(config.history)
+
+        # charger writes run in order on their own thread, so D-Bus callbacks never wait for HTTP
+        self._commands = CommandQueue(gobject.idle_add, self._onCommandDone, name='lektrico-commands-%s' % (name),
+                                      min_interval=config.current_write_interval, clock=self._clock)
 
         logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
 
-        paths_wo_unit = [
-            '/Status'
-        ]
-
-        # get data from go-eCharger
-        data = self._getLektricoChargerData()
-        chargerconfig = self._getLektricoChargerConfig()
-
         # Create the management objects, as specified in the ccgx dbus-api document
         self._dbusservice.add_path('/Mgmt/ProcessName', __file__)
         self._dbusservice.add_path('/Mgmt/ProcessVersion', 'Unkown version, and running on Python ' +
@@ -58,115 +176,114 @@ class DbusLektricoService:
         self._dbusservice.add_path('/ProductId', 0xFFFF)
         self._dbusservice.add_path('/ProductName', productname)
         self._dbusservice.add_path('/CustomName', productname)
-        if data:
-            self._dbusservice.add_path('/FirmwareVersion', int(data['fw_version'].replace('.', '')))
-            self._dbusservice.add_path('/Serial', chargerconfig['serial_number'])
+        self._dbusservice.add_path('/FirmwareVersion', self._static.get('firmware'))
+        self._dbusservice.add_path('/Serial', self._static.get('serial'))
         self._dbusservice.add_path('/HardwareVersion', hardwareVersion)
-        self._dbusservice.add_path('/Connected', 1)
+        # don't wait for the charger: register now, the first poll sets /Connected
+        self._dbusservice.add_path('/Connected', 0)
         self._dbusservice.add_path('/UpdateIndex', 0)
 
-        # add paths without units
-        for path in paths_wo_unit:
+        # hot path instrumentation, refreshed every DEBUG_INTERVAL seconds
+        for path in self._getDebugValues():
             self._dbusservice.add_path(path, None)
 
+        # read-only charger values
+        for field in CHARGER_FIELDS:
+            if not field.writeable:
+                self._dbusservice.add_path(field.path, field.initial, gettextcallback=field.textformat)
+
         # add path values to dbus
         for path, settings in self._paths.items():
             self._dbusservice.add_path(
                 path, settings['initial'], gettextcallback=settings['textformat'], writeable=True,
                 onchangecallback=self._handlechangedvalue)
 
+        # Snapshots are published as a diff against what is already on D-Bus
+        self._convert = compile_fields(CHARGER_FIELDS)
+        self._publisher = DiffPublisher(self._dbusservice, self._getDeadbands(config))
+
         # Register the service on D-Bus after adding all paths
         self._dbusservice.register()
 
         # last update
         self._lastUpdate = 0
 
-        # add _update function 'timer'
-        gobject.timeout_add(250, self._update)
+        # add _update function 'timer', rescheduled after every poll
+        self._scheduleUpdate(self._scheduler.charging_interval)
 
         # add _signOfLife 'timer' to get feedback in log every 5 minutes
         gobject.timeout_add(self._getSignOfLifeInterval() * 60 * 1000, self._signOfLife)
+        gobject.timeout_add_seconds(DEBUG_INTERVAL, self._publishDebug)
 
     def _getConfig(self):
-        config = configparser.ConfigParser()
-        config.read("%s/config.ini" % (os.path.dirname(os.path.realpath(__file__))))
-        return config
+        return self._hub.config
+
+    def _getChargerConfig(self):
+        return self._chargerConfig
+
+    def _applyConfig(self, config):
+        # called by the hub after config.ini was reloaded
+        self._publisher.set_deadbands(self._getDeadbands(config))
+        self._commands.min_interval = config.current_write_interval
+        self._surplus.configure(**config.surplus)
+
+        chargerConfig = config.charger(self._name)
+        if chargerConfig is None:
+            logging.warning("Charger %s was removed from config.ini, keeping old settings until restart" % (self._name))
+            return
+        if chargerConfig.device_instance != self._dbusservice['/DeviceInstance']:
+            logging.warning("Deviceinstance change needs a service restart")
+        if chargerConfig.phases is not None:
+            self._phases = chargerConfig.phases
+        if self._push is not None and (config.push == 'off' or chargerConfig.host != self._push.host):
+            self._stopPush()
+        self._chargerConfig = chargerConfig
+
+    def _getDeadbands(self, config):
+        # defaults from the field table, [DEADBANDS] in config.ini wins
+        bands = deadbands(CHARGER_FIELDS)
+        bands.update(config.deadbands)
+        return bands
+
+    def _openHistory(self, settings):
+        settings = dict(settings)
+        if settings['path']:
+            settings['path'] = os.path.join(settings['path'], 'history-%s.bin' % (self._name))
+        try:
+            return SessionHistory(**settings)
+        except (OSError, ValueError) as e:
+            logging.warning("Cannot open history %s, keeping it in RAM only: %s" % (settings['path'], e))
+            settings['path'] = None
+            return SessionHistory(**settings)
 
     def _getSignOfLifeInterval(self):
-        config = self._getConfig()
-        value = config['DEFAULT']['SignOfLifeLog']
-
-        if not value:
-            value = 0
-
-        return int(value)
+        return self._getConfig().sign_of_life_log
 
     def _getLektricoChargerStatusUrl(self):
-        config = self._getConfig()
-        accessType = config['DEFAULT']['AccessType']
-
-        if accessType == 'OnPremise':
-            URL = "http://%s/rpc/charger_info.get" % (config['ONPREMISE']['Host'])
-        else:
-            raise ValueError("AccessType %s is not supported" % (config['DEFAULT']['AccessType']))
-
-        return URL
+        return self._getChargerConfig().status_url
 
     def _getLektricoChargerConfigUrl(self):
-        config = self._getConfig()
-        accessType = config['DEFAULT']['AccessType']
+        return self._getChargerConfig().config_url
 
-        if accessType == 'OnPremise':
-            URL = "http://%s/rpc/charger_config.get" % (config['ONPREMISE']['Host'])
-        else:
-            raise ValueError("AccessType %s is not supported" % (config['DEFAULT']['AccessType']))
+    def _getLektricoChargerParams(self, method, value, param_name=None):
+        if method == 'charge.start' or method == 'charge.stop':
+            return {"tag": "Victron"}
 
-        return URL
+        # Ensure numeric values are integers for Lektrico API
+        if param_name == 'dynamic_current' and isinstance(value, (int, float)):
+            value = int(value)
 
-    def _getLektricoChargerPayloadUrl(self, method, value, param_name=None):
-        config = self._getConfig()
-        accessType = config['DEFAULT']['AccessType']
+        return {param_name: value} if param_name else {}
 
-        if accessType == 'OnPremise':
-            URL = "http://%s/rpc" % (config['ONPREMISE']['Host'])
-            
-            if method == 'charge.start' or method == 'charge.stop':
-                payload = {
-                    "src": "VenusOS",
-                    "id": random.randint(10000000, 99999999),
-                    "method": method,
-                    "params": {"tag": "Victron"}
-                }
-                
-            else:
-                # Ensure numeric values are integers for Lektrico API
-                if param_name == 'dynamic_current' and isinstance(value, (int, float)):
-                    value = int(value)
-                
-                payload = {
-                    "src": "VenusOS",
-                    "id": random.randint(10000000, 99999999),
-                    "method": method,
-                    "params": {param_name: value} if param_name else {}
-                }
-        else:
-            raise ValueError("AccessType %s is not supported" % (config['DEFAULT']['AccessType']))
-
-        return URL, payload
-
-    def _setLektricoChargerValue(self, method, value, param_name=None):
-        URL, payload = self._getLektricoChargerPayloadUrl(method, value, param_name)
+    def _setLektricoChargerValue(self, method, value, param_name=None, timeout=None):
+        URL = self._getChargerConfig().rpc_url
         logging.debug("Sending to Lektrico: %s" % method)
         
         try:
-            request_data = requests.post(url=URL, json=payload)
-            request_data.raise_for_status()
-            json_data = request_data.json()
+            result = self._rpc.call(URL, method, self._getLektricoChargerParams(method, value, param_name),
+                                    timeout=timeout)
 
-            if not json_data:
-                raise ValueError("Converting response to JSON failed")
-
-            if 'result' in json_data and json_data['result'] is True:
+            if result is True:
                 return True
             else:
                 logging.warning(f"Lektrico parameter {param_name} not set to {value}")
@@ -175,102 +292,103 @@ class DbusLektricoService:
             logging.warning(f"Error setting Lektrico parameter {param_name} to {value}: {e}")
             return False
             
-    def _getLektricoEMStatusUrl(self):
-        config = self._getConfig()
-        accessType = config['DEFAULT']['AccessType']
-
-        if accessType == 'OnPremise':
-            URL = "http://%s/rpc/app_config.get" % (config['ONPREMISE']['EM_Host'])
-        else:
-            raise ValueError("AccessType %s is not supported" % (config['DEFAULT']['AccessType']))
-
-        return URL
-        
     def _setLektricoEMUrl(self):
-        config = self._getConfig()
-        accessType = config['DEFAULT']['AccessType']
-
-        if accessType == 'OnPremise':
-            URL = "http://%s/rpc" % (config['ONPREMISE']['EM_Host'])
-        else:
-            raise ValueError("AccessType %s is not supported" % (config['DEFAULT']['AccessType']))
-
-        return URL
-        
-    def _getLektricoEMData(self):
-        URL = self._getLektricoEMStatusUrl()
-        try:
-            request_data = requests.get(url=URL, timeout=5)
-        except Exception:
+        return self._getConfig().em_rpc_url
+
+    def _resumeCharging(self, command, since, applied=None):
+        # Instead of a fixed delay, restart only once a charger_info shows the change applied and charging
+        # paused: a charge.start sent before the pause would be undone by it. A /StartStop write queued
+        # behind the change cancels the waits, it decides whether the charger runs
+        charging = lambda data: str(data.get('charger_state')) in ('C', 'D')
+        data = self._snapshots.wait(since, applied, timeout=min(CONFIRM_TIMEOUT, command.remaining()))
+        if self._snapshots.cancelled:
+            logging.info("/StartStop write queued, not restarting charge")
             return None
+        if data is None:
+            logging.warning("Change not seen in charger_info, not restarting charge")
+            return None
+        if charging(data):
+            # applied, the pause can still show up in one of the next snapshots
+            paused = lambda data: (applied is None or applied(data)) and not charging(data)
+            data = self._snapshots.wait(since, paused, timeout=min(PAUSE_WINDOW, command.remaining()))
+            if self._snapshots.cancelled:
+                logging.info("/StartStop write queued, not restarting charge")
+                return None
+            if data is None:
+                return False
 
-        # check for response
-        if not request_data:
-            raise ConnectionError("No response from Lektri.co - %s" % (URL))
-
-        json_data = request_data.json()
+        logging.info("Restarting charge after change")
+        restarted = self._setLektricoChargerValue('charge.start', 1, timeout=command.remaining())
+        if not restarted:
+            logging.warning("Failed to resume charging after change")
+        return restarted
 
-        # check for Json
-        if not json_data:
-            raise ValueError("Converting response to JSON failed")
-
-        return json_data
-        
-    def _setLektricoChargerMode(self, mode):
+    def _setLektricoChargerMode(self, mode, was_charging, command):
+        # Runs on the command thread, the outcome is applied in _onCommandDone
         # Map Victron mode values to Lektrico values
         # Lektrico modes: 1=Green, 2=Power, 3=Hybrid
-        mode_mapping = {0: 1, 1: 3, 2: 2}  # Manual→Green, Auto→Hybrid, Scheduled→Power
-        mapped_mode = mode_mapping.get(mode, 2)
+        mapped_mode = MODE_TO_LEKTRICO.get(mode, 2)
         
         logging.info("Setting charger mode to %s (Lektrico mode: %s)" % (mode, mapped_mode))
         
-        # Remember if charger was charging before mode change
-        was_charging = self._dbusservice['/StartStop'] == 1
-        
         try:
-            payload = {
-                "src": "HASS",
-                "id": random.randint(10000000, 99999999),
-                "method": 'app_config.set',
-                "params": {"config_key": 'load_balancing_mode', "config_value": mapped_mode}
-            }
-            
-            URL = self._setLektricoEMUrl()
-            request_data = requests.post(url=URL, json=payload)
-            request_data.raise_for_status()
-            json_data = request_data.json()
-            
-            if not json_data:
-                raise ValueError("Converting response to JSON failed")
+            result = self._rpc.call(self._setLektricoEMUrl(), 'app_config.set',
+                                    {"config_key": 'load_balancing_mode', "config_value": mapped_mode},
+                                    timeout=command.remaining(), src='HASS')
                 
-            if 'result' in json_data and json_data['result'] is True:
-                time.sleep(1)  # Wait for EM to update
-                
-                # If charger was charging before mode change, restart it
+            if result is True:
+                # the EM answers before it passes the mode on, read it back to see it applied
+                em_data = self._getLektricoEMConfig(command)
+                if str(em_data.get('load_balancing_mode')) != str(mapped_mode):
+                    logging.warning("EM still reports mode %s after setting %s" % (
+                        em_data.get('load_balancing_mode'), mapped_mode))
+                    return {'result': False}
+                restarted = None
+
+                # If charger was charging before mode change, restart it if the EM paused it
                 if was_charging:
-                    logging.info("Restarting charge after mode change")
-                    restart_result = self._setLektricoChargerValue('charge.start', 1)
-                    if restart_result:
-                        self._last_start_stop_from_charger = 1
-                    else:
-                        logging.warning("Failed to resume charging after mode change")
-                    self._restarting_after_change = False
+                    restarted = self._resumeCharging(command, self._clock.monotonic())
                 
-                return True
+                return {'result': True, 'mapped_mode': mapped_mode, 'restarted': restarted}
             else:
                 logging.warning(f"Mode not set to {mapped_mode}")
-                return False
+                return {'result': False}
         
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ConnectionError, ValueError) as e:
             logging.warning(f"Error setting mode: {e}")
-            return False
-        
+            return {'result': False}
+
+    def _getLektricoEMConfig(self, command):
+        URL = self._getConfig().em_status_url
+        request_data = self._transport.get(URL, timeout=command.remaining())
+
+        # check for response
+        if not request_data:
+            raise ConnectionError("No response from Lektri.co - %s" % (URL))
+
+        return request_data.json()
+
+    def _setLektricoChargerCurrent(self, current, was_charging, command):
+        # Runs on the command thread, the outcome is applied in _onCommandDone
+        result = self._setLektricoChargerValue(
+            'dynamic_current.set', current, param_name='dynamic_current', timeout=command.remaining())
+        if not result or not was_charging:
+            return {'result': result, 'restarted': None}
+
+        # the restart waits for the new current and the pause in charger_info
+        restarted = self._resumeCharging(command, self._clock.monotonic(),
+                                         lambda data: int(data['dynamic_current']) == int(current))
+        return {'result': True, 'restarted': restarted}
+
+    def _setLektricoChargerStartStop(self, value, command):
+        # restarts after a change wait again from here on
+        self._snapshots.reset()
+        method = 'charge.start' if value == 1 else 'charge.stop'
+        return {'result': self._setLektricoChargerValue(method, value, timeout=command.remaining())}
+
     def _getLektricoChargerData(self):
         URL = self._getLektricoChargerStatusUrl()
-        try:
-            request_data = requests.get(url=URL, timeout=5)
-        except Exception:
-            return None
+        request_data = self._transport.get(URL)
 
         # check for response
         if not request_data:
@@ -286,10 +404,7 @@ class DbusLektricoService:
 
     def _getLektricoChargerConfig(self):
         URL = self._getLektricoChargerConfigUrl()
-        try:
-            request_data = requests.get(url=URL, timeout=5)
-        except Exception:
-            return None
+        request_data = self._transport.get(URL)
 
         # check for response
         if not request_data:
@@ -303,85 +418,372 @@ class DbusLektricoService:
 
         return json_data
 
+    def _getRpcMetrics(self):
+        # RPC stats are kept per host: this charger's own, the EM's once on the first charger
+        config = self._getConfig()
+        sources = [(self._transport.metrics(self._getChargerConfig().host),
+                    [name for name in RPC_NAMES if name not in EM_RPC_NAMES])]
+        if self._name == next(iter(config.chargers)):
+            sources.append((self._transport.metrics(config.em_host), EM_RPC_NAMES))
+        return sources
+
     def _signOfLife(self):
-        logging.info("--- Start: sign of life ---")
+        poll = self._metrics.histogram('poll')
+        logging.info("--- Start: sign of life (%s) ---" % (self._name))
         logging.info("Last _update() call: %s" % (self._lastUpdate))
         logging.info("Last '/Ac/Power': %s" % (self._dbusservice['/Ac/Power']))
+        logging.info("Connection: %s (%d failed requests)" % (self._getHealth().state, self._getHealth().failures))
+        logging.info("Poll: n=%d p50=%.0fms p99=%.0fms max=%.0fms overlapping=%d missed=%d errors=%d" % (
+            poll.count, poll.percentile(50), poll.percentile(99), poll.max, self._metrics.counter('poll.overlapping'),
+            self._metrics.counter('poll.missed'), self._metrics.counter('poll.errors')))
+        for rpcMetrics, names in self._getRpcMetrics():
+            for name in names:
+                if rpcMetrics.histogram(name).count:
+                    logging.info("RPC %s" % (rpcMetrics.summary(name)))
+        logging.info("D-Bus writes: %d (%.1f/s)" % (self._metrics.counter('dbus.writes'), self._dbusWritesPerSecond))
         logging.info("--- End: sign of life ---")
         return True
 
+    def _getDebugValues(self):
+        health = self._getHealth()
+        poll = self._metrics.histogram('poll')
+        values = {
+            '/Debug/Poll/Count': poll.count,
+            '/Debug/Poll/P50': round(poll.percentile(50), 1),
+            '/Debug/Poll/P99': round(poll.percentile(99), 1),
+            '/Debug/Poll/Max': round(poll.max, 1),
+            '/Debug/Poll/Overlapping': self._metrics.counter('poll.overlapping'),
+            '/Debug/Poll/Missed': self._metrics.counter('poll.missed'),
+            '/Debug/Poll/Errors': self._metrics.counter('poll.errors'),
+            '/Debug/Dbus/Writes': self._metrics.counter('dbus.writes'),
+            '/Debug/Dbus/WritesPerSecond': round(self._dbusWritesPerSecond, 2),
+            '/Debug/Connection/State': health.state,
+            '/Debug/Connection/Failures': health.failures,
+        }
+        for rpcMetrics, names in self._getRpcMetrics():
+            for name in names:
+                histogram = rpcMetrics.histogram(name)
+                prefix = '/Debug/Rpc/%s' % (name.replace('.', '_'))
+                values[prefix + '/Count'] = histogram.count
+                values[prefix + '/P50'] = round(histogram.percentile(50), 1)
+                values[prefix + '/P99'] = round(histogram.percentile(99), 1)
+                values[prefix + '/Errors'] = rpcMetrics.counter(name + '.errors')
+                values[prefix + '/Timeouts'] = rpcMetrics.counter(name + '.timeouts')
+        return values
+
+    def _publishDebug(self):
+        now = self._clock.monotonic()
+        writes = self._metrics.counter('dbus.writes')
+        self._dbusWritesPerSecond = (writes - self._lastDbusWrites) / max(now - self._lastDebugTime, 0.001)
+        self._lastDebugTime = now
+        self._lastDbusWrites = writes
+
+        self._publisher.publish(self._getDebugValues())
+        return True
+
+    def _scheduleUpdate(self, interval=None):
+        if self._updateTimer is not None:
+            gobject.source_remove(self._updateTimer)
+        if interval is None:
+            # circuit open: sleep until the next probe instead of polling a dead host
+            health = self._getHealth()
+            if self._pushActive:
+                interval = self._getConfig().push_interval
+            elif health.state == OFFLINE:
+                interval = health.retry_in()
+            else:
+                interval = self._scheduler.next_interval(self._name)
+        self._updateDue = (self._clock.monotonic() + interval, interval)
+        self._updateTimer = gobject.timeout_add(int(interval * 1000), self._update)
+
+    def _requestFastPoll(self):
+        # After a user command: poll fast for a while and don't wait for a long idle interval
+        self._scheduler.boost(self._name)
+        if not self._fetch_in_progress and not self._pushActive:
+            self._scheduleUpdate(self._scheduler.boost_interval)
+
     def _update(self):
+        self._updateTimer = None
+
+        # a tick that runs more than a whole interval late means the main loop was blocked
+        if self._updateDue is not None:
+            due, interval = self._updateDue
+            if self._clock.monotonic() - due > max(interval, 0.25):
+                self._metrics.incr('poll.missed')
+            self._updateDue = None
+
+        # Never block the main loop on the network: start a background fetch and return
+        if self._fetch_in_progress:
+            logging.debug("Previous fetch still running, skipping tick")
+            self._metrics.incr('poll.overlapping')
+            return False
+
+        self._fetch_in_progress = True
+        self._pollStart = self._clock.monotonic()
+        jobs = {'charger': self._getLektricoChargerData}
+        if not self._staticFetched:
+            jobs['config'] = self._getLektricoChargerConfig
+        self._fetchEngine.submit(jobs, self._onSnapshot)
+
+        # one-shot timer, the next poll is scheduled when this one is finished
+        return False
+
+    def _onSnapshot(self, results, errors):
+        # Called on the main loop once the fetch is finished
+        self._fetch_in_progress = False
+        try:
+            self._metrics.observe('poll', self._clock.monotonic() - self._pollStart)
+
+            for name, e in errors.items():
+                logError(name, e)
+
+            data = results.get('charger')
+            if data is not None:
+                self._scheduler.success(str(data.get('charger_state')), self._name)
+            else:
+                self._scheduler.failure(self._name)
+                self._metrics.incr('poll.errors')
+
+            if data is not None:
+                self._snapshots.publish(data, self._pollStart)
+            self._applyStatic(data, results.get('config'))
+            self._applySnapshot(data)
+            self._applyHealth()
+            if data is not None:
+                self._checkPush(data.get('fw_version'))
+        except Exception as e:
+            logging.error('Error in _onSnapshot', exc_info=e)
+        finally:
+            # the poll timer is one-shot, it must be armed again whatever went wrong above
+            self._scheduleUpdate()
+
+    def _checkPush(self, fw_version):
+        # a pushed charger_info replaces the fast poll, auto only tries it once per firmware version
+        mode = self._getConfig().push
+        if mode == 'off' or self._push is not None or self._pushRetryTimer is not None:
+            return
+        if mode == 'auto' and self._static.get('push_unsupported') == fw_version:
+            return
+        config = self._getConfig()
+        self._pushFirmware = fw_version
+        self._push = PushChannel(self._getChargerConfig().host, gobject.idle_add, self._onPushSnapshot,
+                                 self._onPushClosed, keepalive=config.push_keepalive,
+                                 connect_timeout=config.connect_timeout).start()
+
+    def _stopPush(self):
+        self._push.stop()
+        self._push = None
+        self._pushActive = False
+        if not self._fetch_in_progress:
+            self._scheduleUpdate()
+
+    def _onPushSnapshot(self, data):
+        # Called on the main loop for every charger_info the charger pushed
+        if not self._pushActive:
+            logging.info("Charger pushes its state, polling every %ss only" % (self._getConfig().push_interval))
+            self._pushActive = True
+            if not self._fetch_in_progress:
+                self._scheduleUpdate()
+        self._metrics.incr('push.messages')
+        recorder = self._hub.recorder
+        if recorder is not None:
+            recorder.response(self._getLektricoChargerStatusUrl(), data)
+        self._snapshots.publish(data, self._clock.monotonic())
+        self._getHealth().success()
+        self._scheduler.success(str(data.get('charger_state')), self._name)
+        self._applyStatic(data, None)
+        self._applySnapshot(data)
+        self._applyHealth()
+
+    def _onPushClosed(self, error):
+        self._push = None
+        self._pushActive = False
+        if isinstance(error, PushNotSupported):
+            logging.info("%s, polling charger_info" % (error))
+            static = dict(self._static)
+            static['push_unsupported'] = self._pushFirmware
+            self._saveStatic(static)
+        else:
+            logging.warning("Push channel closed (%s), polling charger_info" % (error))
+        self._pushRetryTimer = gobject.timeout_add_seconds(PUSH_RETRY, self._retryPush)
+        if not self._fetch_in_progress:
+            self._scheduleUpdate(0)
+
+    def _retryPush(self):
+        # the next successful poll opens the channel again
+        self._pushRetryTimer = None
+        return False
+
+    def _getHealth(self):
+        return self._transport.health(self._getChargerConfig().host)
+
+    def _applyHealth(self):
+        # /Connected follows the circuit breaker: degraded is still connected, offline/probing is not
+        connected = 1 if self._getHealth().connected else 0
+        if connected == self._dbusservice['/Connected']:
+            return
+        values = {'/Connected': connected}
+        if not connected:
+            # don't leave the last readings on the GX as if they were live
+            for path in LIVE_PATHS:
+                values[path] = 0
+        self._updating = True
+        self._publisher.publish(values)
+        self._updating = False
+
+    def _applyStatic(self, data, chargerconfig):
+        # firmware and serial rarely change, keep them on disk for the next start.
+        # Own try: odd static info must never cost the live readings of a snapshot
         try:
-            data = self._getLektricoChargerData()
-            em_data = self._getLektricoEMData()
+            static = dict(self._static)
+            if data is not None:
+                firmware = parseFirmware(data.get('fw_version'))
+                if firmware is not None:
+                    static['firmware'] = firmware
+            if chargerconfig:
+                # read once per run, also when the answer has no serial
+                self._staticFetched = True
+                serial = chargerconfig.get('serial_number')
+                if serial is not None:
+                    static['serial'] = serial
+                else:
+                    logging.warning("charger_config has no serial_number")
+
+            self._saveStatic(static)
+        except Exception as e:
+            logging.error('Error in _applyStatic', exc_info=e)
+
+    def _saveStatic(self, static):
+        if static != self._static:
+            self._static = static
+            self._staticCache.set(self._name, static)
+            self._publisher.publish({'/FirmwareVersion': static.get('firmware'), '/Serial': static.get('serial')})
 
+    def _applySnapshot(self, data):
+        em_data = self._emCache.get('app_config')
+        try:
             if data is not None:
                 self._updating = True
-                
-                # Update power and energy values
-                self._dbusservice['/Ac/L1/Power'] = int(data['instant_power'])
-                self._dbusservice['/Ac/Power'] = int(data['instant_power'])
-                self._dbusservice['/Ac/Voltage'] = int(data['voltage'])
-                self._dbusservice['/Current'] = int(data['current'])
-                self._dbusservice['/Session/Energy'] = float(data['session_energy'])/1000
-                self._dbusservice['/Ac/Energy/Forward'] = float(data['total_charged_energy'])
+
+                # plain charger_info copies, see CHARGER_FIELDS
+                values = self._convert(data)
+
+                # Per phase values, 1p/3p comes from config.ini or is detected once from the charger data
+                if self._phases is None and detect_phases(data) == 3:
+                    logging.info("3-phase charger detected")
+                    self._phases = 3
+                currents, voltages, powers = phase_values(data, self._phases or 1)
+                for phase, current, voltage, power in zip(PHASES, currents, voltages, powers):
+                    values['/Ac/%s/Power' % phase] = int(power)
+                    values['/Ac/%s/Current' % phase] = round(current, 1)
+                    values['/Ac/%s/Voltage' % phase] = int(voltage)
 
                 # Update current - log only if changed
-                charger_dynamic_current = int(data['dynamic_current'])
+                charger_dynamic_current = values['/SetCurrent']
                 if self._last_set_current_from_charger is not None and charger_dynamic_current != self._last_set_current_from_charger:
                     logging.info("Current changed: %d → %dA" % (self._last_set_current_from_charger, charger_dynamic_current))
                 
                 self._last_set_current_from_charger = charger_dynamic_current
-                self._dbusservice['/SetCurrent'] = charger_dynamic_current
-                self._dbusservice['/MaxCurrent'] = charger_dynamic_current
-                self._dbusservice['/ChargingTime'] = int(data['charging_time'])
-                
-                # Map Lektrico mode to Victron mode
-                mode_mapping = {'3': 1, '1': 0, '2': 2}  # Green→Auto, Power→Manual, Hybrid→Scheduled
-                mode = mode_mapping.get(str(em_data['load_balancing_mode']), 0)
-                
-                # Log only mode changes
-                if self._last_mode_from_charger is not None and mode != self._last_mode_from_charger:
-                    logging.info("Mode changed: %d → %d" % (self._last_mode_from_charger, mode))
-                
-                self._last_mode_from_charger = mode
-                self._dbusservice['/Mode'] = mode
-                self._dbusservice['/MCU/Temperature'] = int(data['temperature'])
                 
-                # Map charger state to status
-                state_mapping = {'A': 0, 'B': 1, 'C': 2, 'D': 3}
-                status = state_mapping.get(str(data['charger_state']), 0)
-                self._dbusservice['/Status'] = status
+                # Map Lektrico mode to Victron mode (skipped while the EM settings are unknown or stale)
+                if em_data is not None:
+                    mode = MODE_FROM_LEKTRICO.get(str(em_data['load_balancing_mode']), 0)
+
+                    # Log only mode changes
+                    if self._last_mode_from_charger is not None and mode != self._last_mode_from_charger:
+                        logging.info("Mode changed: %d → %d" % (self._last_mode_from_charger, mode))
+
+                    self._last_mode_from_charger = mode
+                    values['/Mode'] = mode
                 
                 # Map status to start/stop (only C=charging means started)
-                new_start_stop = 1 if status == 2 else 0
+                new_start_stop = 1 if values['/Status'] == 2 else 0
                 
                 # Log only state changes
                 if new_start_stop != self._dbusservice['/StartStop']:
                     logging.info("Charger state changed: %s → /StartStop=%d" % (data['charger_state'], new_start_stop))
                 
-                self._last_start_stop_from_charger = new_start_stop
-                self._dbusservice['/StartStop'] = new_start_stop
-
-                # Update index
-                index = (self._dbusservice['/UpdateIndex'] + 1) % 256
-                self._dbusservice['/UpdateIndex'] = index
-                self._lastUpdate = time.time()
+                # a pause caused by our own change is not a stop, /StartStop writes are compared against it
+                if not self._restarting_after_change:
+                    self._last_start_stop_from_charger = new_start_stop
+                values['/StartStop'] = new_start_stop
+
+                # Don't flip paths back to the old charger value while our write to them is still running
+                for path in self._pendingCommands:
+                    values.pop(path, None)
+                if self._restarting_after_change:
+                    values.pop('/StartStop', None)
+
+                # Only write what changed (outside the deadbands), and only then bump the index
+                changed = self._publisher.publish(values)
+                self._metrics.incr('dbus.writes', len(changed))
+                if changed:
+                    index = (self._dbusservice['/UpdateIndex'] + 1) % 256
+                    self._dbusservice['/UpdateIndex'] = index
+                self._lastUpdate = self._clock.time()
                 self._updating = False
+
+                self._history.add(self._lastUpdate, int(data['session_id']), float(data['instant_power']),
+                                  float(data['current']), float(data['session_energy']))
+                self._applySurplus(data)
             else:
                 logging.debug("Charger not available")
                 self._updating = False
 
         except Exception as e:
-            logging.critical('Error in _update', exc_info=e)
+            logging.error('Error in _applySnapshot', exc_info=e)
             self._updating = False
 
-        return True
+    def _applySurplus(self, data):
+        # wait for our last step first: the pause a current change causes while charging is not a stop
+        if '/SetCurrent' in self._pendingCommands or self._restarting_after_change:
+            return
+        config = self._getConfig()
+        system = self._hub.systemValues
+        if not config.surplus_enabled or system is None or self._dbusservice['/Mode'] != 1 \
+                or self._dbusservice['/StartStop'] != 1:
+            self._surplus.reset()
+            return
+
+        # never go below what the car accepts, as configured on the EM
+        em_data = self._emCache.get('app_config')
+        min_current = config.surplus_min_current
+        if em_data is not None and 'car_minimum_current' in em_data:
+            min_current = int(em_data['car_minimum_current'])
+
+        current = int(data['dynamic_current'])
+        target = self._surplus.target(system, float(data['instant_power']), current, float(data['voltage']),
+                                      self._phases or 1, min_current, int(data['install_current']),
+                                      self._clock.monotonic())
+        if target is None or target == current:
+            return
+
+        logging.debug("Solar surplus: grid %s W, PV %s W, battery %s W → %d A" % (
+            system.grid, system.pv, system.battery, target))
+
+        # same write as a /SetCurrent change while charging, restarted if the charger pauses for it
+        previous = self._dbusservice['/SetCurrent']
+        run = lambda command: self._setLektricoChargerCurrent(target, True, command)
+        command = Command('/SetCurrent', target, run, config.command_timeout, previous=previous, coalesce=True,
+                          clock=self._clock)
+        queued = self._commands.submit(command)
+        if queued is None:
+            self._pendingCommands['/SetCurrent'] = self._pendingCommands.get('/SetCurrent', 0) + 1
+        self._restarting_after_change.add(queued or command)
+        self._updating = True
+        self._dbusservice['/SetCurrent'] = target
+        self._updating = False
 
     def _handlechangedvalue(self, path, value):
-        # Ignore changes during state updates to prevent feedback loops
-        if self._updating or self._restarting_after_change:
-            logging.debug("Ignoring %s change during update/restart" % path)
+        # in record mode every write is kept, also the ignored ones, so a replay hits the same guards
+        recorder = self._hub.recorder
+        if recorder is not None:
+            recorder.write(self._name, path, value)
+
+        # Ignore changes during state updates to prevent feedback loops. Writes during a restart after
+        # a change are queued behind it like any other, the command thread runs them in order
+        if self._updating:
+            logging.debug("Ignoring %s change during update" % path)
             return True
         
         # Try to identify the D-Bus sender (for debugging external control)
@@ -396,7 +798,7 @@ class DbusLektricoService:
                 return True
             else:
                 # Check if this is a delayed callback from recent user command
-                time_since_last_command = time.time() - self._last_user_start_stop_time
+                time_since_last_command = self._clock.time() - self._last_user_start_stop_time
                 if self._last_user_start_stop_command == value and time_since_last_command < 5.0:
                     logging.debug("Ignoring /StartStop - delayed callback")
                     self._last_start_stop_from_charger = value
@@ -425,85 +827,289 @@ class DbusLektricoService:
                 logging.info("/Mode changed: %s → %s" % (self._last_mode_from_charger, value))
                 self._last_mode_from_charger = None
            
+        # Writes run on the command thread, the D-Bus value is accepted now and rolled back if the command fails
+        previous = self._dbusservice[path] if path in self._paths else None
+
         if path == '/StartStop':
             self._last_user_start_stop_command = value
-            self._last_user_start_stop_time = time.time()
-            return self._setLektricoChargerValue('charge.start' if value == 1 else 'charge.stop', value)            
-            
+            self._last_user_start_stop_time = self._clock.time()
+            if self._restarting_after_change:
+                # don't make this write wait for a restart it overrides, cancelled before it is queued
+                # so it can't have run (and reset the waiter) already
+                self._snapshots.cancel()
+            run = lambda command: self._setLektricoChargerStartStop(value, command)
+
         elif path == '/SetCurrent':
             was_charging = self._dbusservice['/StartStop'] == 1
-            if was_charging:
-                self._restarting_after_change = True
-            
-            result = self._setLektricoChargerValue('dynamic_current.set', value, param_name='dynamic_current')
-            if result:
-                self._last_set_current_from_charger = value
-                
-                if was_charging:
-                    time.sleep(0.5)
-                    restart_result = self._setLektricoChargerValue('charge.start', 1)
-                    if restart_result:
-                        self._last_start_stop_from_charger = 1
-                    self._restarting_after_change = False
-            else:
-                self._restarting_after_change = False
-                
-            return result
-            
+            run = lambda command: self._setLektricoChargerCurrent(value, was_charging, command)
+
         elif path == '/Mode':
             was_charging = self._dbusservice['/StartStop'] == 1
-            if was_charging:
-                self._restarting_after_change = True
-            
-            result = self._setLektricoChargerMode(value)
-            if result:
-                self._last_mode_from_charger = value
-            
-            self._restarting_after_change = False
-            return result
-            
+            run = lambda command: self._setLektricoChargerMode(value, was_charging, command)
+
         elif path == '/EnableDisplay':
-            return self._setLektricoChargerValue('/EnableDisplay', 1)
+            run = lambda command: {'result': self._setLektricoChargerValue('/EnableDisplay', 1, timeout=command.remaining())}
         else:
             logging.warning("Unknown path: %s" % path)
             return False
 
+        # Bursts of /SetCurrent writes (ESS, solar surplus scripts) are folded into the queued one
+        command = Command(path, value, run, self._getConfig().command_timeout, previous=previous,
+                          coalesce=path == '/SetCurrent', clock=self._clock)
+        queued = self._commands.submit(command)
+        if queued is not None:
+            logging.debug("Coalesced %s=%s into queued write" % (path, value))
+        else:
+            self._pendingCommands[path] = self._pendingCommands.get(path, 0) + 1
+        if path in ('/SetCurrent', '/Mode') and was_charging:
+            self._restarting_after_change.add(queued or command)
+
+        # Follow the result of the command closely, writes that change nothing don't get here
+        self._requestFastPoll()
+        return True
+
+    def _onCommandDone(self, command, outcome, error):
+        # Called on the main loop once a write finished (or failed/timed out) on the command thread
+        path = command.path
+        self._pendingCommands[path] -= 1
+        if not self._pendingCommands[path]:
+            del self._pendingCommands[path]
+
+        if error is not None:
+            logging.warning("Command %s=%s failed: %s" % (path, command.value, error))
+            outcome = {'result': False}
+
+        result = outcome['result']
+        if path == '/SetCurrent':
+            if result:
+                self._last_set_current_from_charger = command.value
+                if outcome['restarted']:
+                    self._last_start_stop_from_charger = 1
+
+        elif path == '/Mode':
+            if result:
+                self._last_mode_from_charger = command.value
+                # Don't wait for the next EM poll to see our own change
+                self._emCache.patch('app_config', load_balancing_mode=outcome['mapped_mode'])
+                if outcome['restarted']:
+                    self._last_start_stop_from_charger = 1
+
+        self._restarting_after_change.discard(command)
+        if not result and command.previous is not None and not self._pendingCommands.get(path):
+            # Report the failure back on D-Bus: show what the charger still uses
+            logging.warning("%s not changed to %s, rolling back to %s" % (path, command.value, command.previous))
+            self._updating = True
+            self._dbusservice[path] = command.previous
+            self._updating = False
+
+        self._requestFastPoll()
+
     def _get_dbus_sender(self):
         """Get D-Bus sender information for debugging external control"""
         try:
             msg = dbus.lowlevel.get_calling_message()
-            if msg:
-                sender = msg.get_sender()
-                bus = dbus.SystemBus()
-                pid = bus.get_unix_process_id(sender)
-                
-                # Try to find service name
-                dbus_obj = bus.get_object('org.freedesktop.DBus', '/org/freedesktop/DBus')
-                dbus_iface = dbus.Interface(dbus_obj, 'org.freedesktop.DBus')
-                names = dbus_iface.ListNames()
-                for name in names:
-                    if not name.startswith(':'):
-                        try:
-                            owner = dbus_iface.GetNameOwner(name)
-                            if owner == sender:
-                                return "%s (PID:%s)" % (name, pid)
-                        except:
-                            pass
-                return "PID:%s" % pid
+            if msg and self._hub.senderCache is not None:
+                return self._hub.senderCache.lookup(msg.get_sender())
         except Exception as e:
             logging.debug("Could not identify D-Bus sender: %s" % e)
         return None
 
 
+class DbusLektricoHub:
+    """Shared parts for all chargers of this process: config, HTTP sessions, fetch threads, scheduler and the EM poll"""
+
+    def __init__(self, servicename, paths, configfile=None, logs=None, clock=SYSTEM_CLOCK):
+        # config.ini is parsed once here and only re-read when the file changes
+        self.clock = clock  # timeouts, rate limits and caches run on it, bench/replay.py passes the recorded time
+        if configfile is None:
+            configfile = "%s/config.ini" % (os.path.dirname(os.path.realpath(__file__)))
+        self.config = LektricoConfig(configfile)
+        config = self.config
+
+        # log rotation and repeat suppression from [LOGGING], the log thread is started by main()
+        self.logs = logs
+        if logs is not None:
+            logs.configure(**config.logs)
+
+        # one keep-alive session per host, shared by every request to the chargers and EM
+        self.transport = HttpTransport(
+            pool_size=config.pool_size,
+            connect_timeout=config.connect_timeout,
+            read_timeout=config.read_timeout,
+            health=config.health,
+            clock=clock)
+
+        # JSON-RPC writes to chargers and EM, ids are counted up so answers can be matched
+        self.rpc = RpcClient(self.transport)
+
+        # optional record mode: everything the chargers/EM answered and every write, see bench/replay.py
+        self.recorder = None
+        self._applyRecorder()
+
+        # poll interval follows the charger state: fast while charging, slow when idle, backoff when offline
+        self.scheduler = PollScheduler(clock=clock, **config.polling)
+
+        # EM settings (load_balancing_mode) change rarely: own slow poll, cached in between
+        self.emCache = TTLCache(config.em_cache_ttl, clock=clock)
+        self._emTimer = None
+        self._em_fetch_in_progress = False
+
+        # network I/O runs on worker threads, results come back via the main loop
+        self.fetchEngine = FetchEngine(gobject.idle_add, workers=len(config.chargers) + 1)
+
+        # firmware/serial of the last run, shown until the chargers answer
+        self.staticCache = FileCache(config.static_cache)
+
+        self._scheduleEMUpdate(0)
+
+        # who wrote a path is logged for every change, keep the bus names cached instead of asking the bus each time
+        try:
+            self.senderCache = DbusSenderCache(dbus.SystemBus())
+        except Exception as e:
+            logging.warning("D-Bus sender lookup not available: %s" % e)
+            self.senderCache = None
+
+        # grid/PV/battery for the solar surplus controller, followed through D-Bus signals
+        self.systemValues = None
+        if config.surplus_enabled:
+            self._startSystemValues()
+
+        # one D-Bus service per charger
+        self.services = {}
+        for name, chargerConfig in config.chargers.items():
+            self.services[name] = DbusLektricoService(
+                self, name, servicename, paths, productname=chargerConfig.product_name)
+
+        # pick up config.ini changes (new hosts, timeouts) without a restart
+        gobject.timeout_add_seconds(5, self._checkConfig)
+        if hasattr(gobject, 'unix_signal_add'):
+            gobject.unix_signal_add(gobject.PRIORITY_DEFAULT, signal.SIGHUP, self._reloadConfig)
+            gobject.unix_signal_add(gobject.PRIORITY_DEFAULT, signal.SIGTERM, self._terminate)
+
+        # set by main(), quit on SIGTERM after the history is saved
+        self.mainloop = None
+
+    def _checkConfig(self, force=False):
+        config = self.config
+        if config.reload_if_changed(force=force):
+            if set(config.chargers) != set(self.services):
+                logging.warning("Adding or removing chargers needs a service restart")
+            # drop sessions to the old hosts and apply pool size/timeouts
+            self.transport.configure(config.pool_size, config.connect_timeout, config.read_timeout, config.health)
+            self.scheduler.configure(**config.polling)
+            self.emCache.ttl = config.em_cache_ttl
+            if self.logs is not None:
+                self.logs.configure(**config.logs)
+            self._applyRecorder()
+            if config.surplus_enabled and self.systemValues is None:
+                self._startSystemValues()
+            for service in self.services.values():
+                service._applyConfig(config)
+            if not self._em_fetch_in_progress:
+                self._scheduleEMUpdate()
+        return True
+
+    def _applyRecorder(self):
+        config = self.config
+        settings = config.record
+        recorder = self.recorder
+        if recorder is not None and (recorder.path, recorder.max_bytes) == (settings['path'], settings['max_bytes']):
+            return
+        if recorder is not None:
+            recorder.close()
+        self.recorder = None
+
+        if settings['path']:
+            # what bench/replay.py needs to set up the same chargers again
+            recorded = {
+                'chargers': dict((name, {'host': c.host, 'deviceinstance': c.device_instance, 'phases': c.phases})
+                                 for name, c in config.chargers.items()),
+                'em_host': config.em_host,
+                'command_timeout': config.command_timeout,
+                'current_write_interval': config.current_write_interval,
+            }
+            try:
+                self.recorder = Recorder(settings['path'], recorded, max_bytes=settings['max_bytes'])
+            except (IOError, OSError) as e:
+                logging.warning("Cannot record to %s: %s" % (settings['path'], e))
+        self.transport.recorder = self.recorder
+
+    def _startSystemValues(self):
+        try:
+            self.systemValues = SystemValues(dbus.SystemBus())
+        except Exception as e:
+            logging.warning("Solar surplus control not available: %s" % e)
+
+    def _reloadConfig(self):
+        logging.info("SIGHUP received, reloading config")
+        return self._checkConfig(force=True)
+
+    def _terminate(self):
+        logging.info("SIGTERM received, saving history")
+        for service in self.services.values():
+            service._history.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.mainloop is not None:
+            self.mainloop.quit()
+        return False
+
+    def _getLektricoEMData(self):
+        URL = self.config.em_status_url
+        request_data = self.transport.get(URL)
+
+        # check for response
+        if not request_data:
+            raise ConnectionError("No response from Lektri.co - %s" % (URL))
+
+        json_data = request_data.json()
+
+        # check for Json
+        if not json_data:
+            raise ValueError("Converting response to JSON failed")
+
+        return json_data
+
+    def _scheduleEMUpdate(self, interval=None):
+        if self._emTimer is not None:
+            gobject.source_remove(self._emTimer)
+        if interval is None:
+            interval = self.config.em_interval
+        self._emTimer = gobject.timeout_add(int(interval * 1000), self._updateEM)
+
+    def _updateEM(self):
+        self._emTimer = None
+        if self._em_fetch_in_progress:
+            return False
+
+        self._em_fetch_in_progress = True
+        self.fetchEngine.submit({'em': self._getLektricoEMData}, self._onEMSnapshot)
+        return False
+
+    def _onEMSnapshot(self, results, errors):
+        self._em_fetch_in_progress = False
+
+        if 'em' in errors:
+            logError('em', errors['em'])
+
+        em_data = results.get('em')
+        if em_data is not None:
+            self.emCache.set('app_config', em_data)
+        else:
+            logging.debug("EM not available, cached settings are %s s old" % (self.emCache.age('app_config')))
+
+        self._scheduleEMUpdate()
+
+
+def getDbusPaths():
+    # writeable paths, the read-only ones are added by the service itself
+    return dict((field.path, {'initial': field.initial, 'textformat': field.textformat})
+                for field in CHARGER_FIELDS if field.writeable)
+
+
 def main():
-    # configure logging
-    logging.basicConfig(format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        level=logging.INFO,
-                        handlers=[
-                            logging.FileHandler("%s/current.log" % (os.path.dirname(os.path.realpath(__file__)))),
-                            logging.StreamHandler()
-                        ])
+    # configure logging, written by a background thread so the main loop never waits for the disk
+    logs = setup_logging("%s/current.log" % (os.path.dirname(os.path.realpath(__file__))))
 
     try:
         logging.info("Start")
@@ -512,39 +1118,20 @@ def main():
         # Have a mainloop, so we can send/receive asynchronous calls to and from dbus
         DBusGMainLoop(set_as_default=True)
 
-        _kwh = lambda p, v: (str(round(v, 2)) + 'kWh')
-        _a = lambda p, v: (str(round(v, 1)) + 'A')
-        _w = lambda p, v: (str(round(v, 1)) + 'W')
-        _v = lambda p, v: (str(round(v, 1)) + 'V')
-        _degC = lambda p, v: (str(v) + '°C')
-        _s = lambda p, v: (str(v) + 's')
-
-        pvac_output = DbusLektricoService(
+        pvac_output = DbusLektricoHub(
             servicename='com.victronenergy.evcharger',
-            paths={
-                '/Ac/Power': {'initial': 0, 'textformat': _w},
-                '/Ac/L1/Power': {'initial': 0, 'textformat': _w},
-                '/Ac/L2/Power': {'initial': 0, 'textformat': _w},
-                '/Ac/L3/Power': {'initial': 0, 'textformat': _w},
-                '/Ac/Energy/Forward': {'initial': 0, 'textformat': _kwh},
-                '/Session/Energy': {'initial': 0, 'textformat': _kwh},
-                '/ChargingTime': {'initial': 0, 'textformat': _s},
-
-                '/Ac/Voltage': {'initial': 0, 'textformat': _v},
-                '/Current': {'initial': 0, 'textformat': _a},
-                '/SetCurrent': {'initial': 0, 'textformat': _a},
-                '/MaxCurrent': {'initial': 0, 'textformat': _a},
-                '/MCU/Temperature': {'initial': 0, 'textformat': _degC},
-                '/StartStop': {'initial': 0, 'textformat': lambda p, v: (str(v))},
-                '/Mode': {'initial': 0, 'textformat': lambda p, v: (str(v))}
-            }
+            paths=getDbusPaths(),
+            logs=logs
         )
 
         logging.info('Connected to dbus, and switching over to gobject.MainLoop() (= event based)')
         mainloop = gobject.MainLoop()
+        pvac_output.mainloop = mainloop
         mainloop.run()
     except Exception as e:
         logging.critical('Error at %s', 'main', exc_info=e)
+    finally:
+        logs.stop()
 
 
 if __name__ == "__main__":
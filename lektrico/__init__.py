@@ -0,0 +1,66 @@
+"""Helpers for the Lektri.co dbus service (dbus-lektrico-evcharger.py)"""
+
+from .cache import FileCache, TTLCache
+from .clock import SYSTEM_CLOCK, Clock
+from .commands import Command, CommandQueue, CommandTimeout, SnapshotWaiter
+from .config import LektricoConfig
+from .fetcher import FetchEngine
+from .fields import Field, compile_fields, deadbands
+from .health import DEGRADED, OFFLINE, ONLINE, PROBING, UNKNOWN, HostHealth, HostOffline
+from .history import SessionHistory
+from .logs import LogPipeline, RepeatFilter, setup_logging
+from .metrics import Histogram, Metrics
+from .phases import detect_phases, phase_values
+from .publisher import DiffPublisher
+from .push import PushChannel, PushNotSupported, WebSocket
+from .recording import Recorder, ReplayClock, ReplayTransport, load_recording
+from .rpc import RpcClient
+from .scheduler import PollScheduler
+from .senders import DbusSenderCache
+from .surplus import SurplusController, SystemValues
+from .transport import HttpTransport
+
+__all__ = [
+    'DEGRADED',
+    'OFFLINE',
+    'ONLINE',
+    'PROBING',
+    'SYSTEM_CLOCK',
+    'UNKNOWN',
+    'Clock',
+    'Command',
+    'CommandQueue',
+    'CommandTimeout',
+    'DbusSenderCache',
+    'DiffPublisher',
+    'FetchEngine',
+    'Field',
+    'FileCache',
+    'Histogram',
+    'HostHealth',
+    'HostOffline',
+    'HttpTransport',
+    'LektricoConfig',
+    'LogPipeline',
+    'Metrics',
+    'PollScheduler',
+    'PushChannel',
+    'PushNotSupported',
+    'Recorder',
+    'RepeatFilter',
+    'ReplayClock',
+    'ReplayTransport',
+    'RpcClient',
+    'SessionHistory',
+    'SnapshotWaiter',
+    'SurplusController',
+    'SystemValues',
+    'TTLCache',
+    'WebSocket',
+    'compile_fields',
+    'deadbands',
+    'detect_phases',
+    'load_recording',
+    'phase_values',
+    'setup_logging',
+]
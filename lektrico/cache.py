@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+
+from .clock import SYSTEM_CLOCK
+
+
+class TTLCache:
+    """Small key/value cache whose entries expire after ttl seconds"""
+
+    def __init__(self, ttl, clock=SYSTEM_CLOCK):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = {}
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or self._clock.monotonic() - entry[1] > self.ttl:
+            return default
+        return entry[0]
+
+    def set(self, key, value):
+        self._entries[key] = (value, self._clock.monotonic())
+
+    def patch(self, key, **changes):
+        """Update fields of a cached dict in place, e.g. right after we changed them on the device"""
+        value = self.get(key)
+        if value is None:
+            return False
+        value = dict(value)
+        value.update(changes)
+        self.set(key, value)
+        return True
+
+    def age(self, key):
+        entry = self._entries.get(key)
+        return None if entry is None else self._clock.monotonic() - entry[1]
+
+
+class FileCache:
+    """Small JSON key/value store on disk for values that survive a restart (firmware, serial)
+
+    The file is only rewritten when a value really changed. path None keeps everything in memory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        if path:
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                pass
+
+    def get(self, key, default=None):
+        return self._entries.get(key, default)
+
+    def set(self, key, value):
+        if self._entries.get(key) == value:
+            return False
+        self._entries[key] = value
+        if self.path:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                # write a new file and swap it in, a power cut never leaves half a file behind
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(self._entries, f)
+                os.replace(self.path + '.tmp', self.path)
+            except (IOError, OSError) as e:
+                logging.warning("Cannot write %s: %s" % (self.path, e))
+        return True
@@ -0,0 +1,29 @@
+import time
+
+
+class Clock:
+    """Wall and monotonic time as the time module gives them, bench/replay.py uses a ReplayClock instead
+
+    Everything that times out or rate limits takes a clock, so a replay runs it on the recorded time.
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait_until(self, cond, deadline=None):
+        """cond.wait() with cond held, until notified or monotonic() reaches deadline (None: no deadline)"""
+        if deadline is None:
+            cond.wait()
+            return
+        remaining = deadline - self.monotonic()
+        if remaining > 0:
+            cond.wait(remaining)
+
+
+SYSTEM_CLOCK = Clock()
@@ -0,0 +1,153 @@
+import collections
+import logging
+import threading
+
+from .clock import SYSTEM_CLOCK
+
+
+class CommandTimeout(Exception):
+    pass
+
+
+class Command:
+    """One write to the charger/EM, triggered by a D-Bus path change
+
+    Commands with coalesce set replace a queued, not yet started command for the same path,
+    so a burst of writes ends up as one request with the latest value.
+    """
+
+    def __init__(self, path, value, run, timeout, previous=None, coalesce=False, clock=SYSTEM_CLOCK):
+        self.path = path
+        self.value = value
+        self.run = run
+        self.previous = previous  # value on D-Bus before the write, to roll back on failure
+        self.coalesce = coalesce
+        self.merged = 0  # number of later writes folded into this command
+        self._clock = clock
+        self.deadline = clock.monotonic() + timeout
+
+    def remaining(self):
+        """Seconds left for this command, raises CommandTimeout when it's used up"""
+        remaining = self.deadline - self._clock.monotonic()
+        if remaining <= 0:
+            raise CommandTimeout("%s=%s timed out" % (self.path, self.value))
+        return remaining
+
+    def merge(self, other):
+        self.value = other.value
+        self.run = other.run
+        self.deadline = other.deadline
+        self.merged += 1
+
+
+class CommandQueue:
+    """Runs commands one after the other on a worker thread and reports the outcome on the main loop
+
+    callback(command, result, error) is called via idle_add once a command is finished.
+    Coalescing commands for the same path are started at most once per min_interval seconds.
+    """
+
+    def __init__(self, idle_add, callback, name='lektrico-commands', min_interval=0, clock=SYSTEM_CLOCK):
+        self._idle_add = idle_add
+        self._callback = callback
+        self.min_interval = min_interval
+        self._clock = clock
+        self._pending = collections.deque()
+        self._last_start = {}  # path -> monotonic time the last coalescing command for it was started
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._worker, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, command):
+        """Queue a command, returns the queued command it was merged into or None if it was queued as new"""
+        with self._cond:
+            if command.coalesce:
+                for queued in self._pending:
+                    if queued.coalesce and queued.path == command.path:
+                        queued.merge(command)
+                        return queued
+            self._pending.append(command)
+            self._cond.notify()
+        return None
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+
+                command = self._pending[0]
+                if command.coalesce:
+                    # rate limit writes for this path, later writes keep merging in while we wait
+                    last_start = self._last_start.get(command.path)
+                    if last_start is not None and self._clock.monotonic() < last_start + self.min_interval:
+                        self._clock.wait_until(self._cond, last_start + self.min_interval)
+                        continue
+                    self._last_start[command.path] = self._clock.monotonic()
+
+                return self._pending.popleft()
+
+    def _worker(self):
+        while True:
+            command = self._next()
+            result = None
+            error = None
+            try:
+                command.remaining()  # expired while waiting in the queue
+                result = command.run(command)
+            except Exception as e:
+                error = e
+
+            logging.debug("Command %s=%s finished: %s" % (command.path, command.value, error or result))
+            self._idle_add(self._deliver, command, result, error)
+
+    def _deliver(self, command, result, error):
+        self._callback(command, result, error)
+        return False  # run once
+
+
+class SnapshotWaiter:
+    """Lets the command thread wait for a charger_info snapshot instead of sleeping a fixed time
+
+    The main loop publishes every snapshot with the monotonic time its fetch started, wait()
+    only accepts snapshots fetched after a given moment, e.g. after our RPC was answered.
+    cancel() ends running and later waits until reset(), once a later write decides anyway.
+    """
+
+    def __init__(self, clock=SYSTEM_CLOCK):
+        self._cond = threading.Condition()
+        self._clock = clock
+        self._snapshot = None
+        self._fetched = 0
+        self.cancelled = False
+
+    def publish(self, data, fetched):
+        with self._cond:
+            self._snapshot = data
+            self._fetched = fetched
+            self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self.cancelled = True
+            self._cond.notify_all()
+
+    def reset(self):
+        with self._cond:
+            self.cancelled = False
+
+    def wait(self, since, predicate=None, timeout=5.0):
+        """First snapshot fetched after since (matching predicate), None if there is none within timeout or cancelled"""
+        end = self._clock.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self.cancelled:
+                    return None
+                snapshot = self._snapshot
+                if snapshot is not None and self._fetched >= since and (predicate is None or predicate(snapshot)):
+                    return snapshot
+                if self._clock.monotonic() >= end:
+                    return None
+                self._clock.wait_until(self._cond, end)
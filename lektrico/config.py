@@ -0,0 +1,238 @@
+import configparser
+import logging
+import os
+
+
+CHARGER_SECTION_PREFIX = 'CHARGER:'
+
+
+class ChargerConfig:
+    """Settings of one Lektri.co station, from a [CHARGER:x] section or the single-charger [ONPREMISE] Host"""
+
+    def __init__(self, name, host, device_instance, hardware_version, product_name, phases=None):
+        self.name = name
+        self.host = host
+        self.device_instance = device_instance
+        self.hardware_version = hardware_version
+        self.product_name = product_name
+        self.phases = phases  # 1, 3 or None to detect it from the charger data
+
+        self.status_url = "http://%s/rpc/charger_info.get" % (host)
+        self.config_url = "http://%s/rpc/charger_config.get" % (host)
+        self.rpc_url = "http://%s/rpc" % (host)
+
+
+class LektricoConfig:
+    """config.ini parsed and validated once, re-read only when the file changes"""
+
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self.load()
+
+    def load(self):
+        mtime = self._get_mtime()
+        parser = configparser.ConfigParser()
+        if not parser.read(self.path):
+            raise ValueError("Config file %s not found" % (self.path))
+
+        access_type = parser['DEFAULT']['AccessType']
+        if access_type != 'OnPremise':
+            raise ValueError("AccessType %s is not supported" % (access_type))
+
+        onpremise = parser['ONPREMISE']
+        em_host = onpremise.get('EM_Host')
+        if not em_host:
+            raise ValueError("EM_Host must be set in [ONPREMISE]")
+
+        chargers = self._parse_chargers(parser)
+
+        sign_of_life = parser['DEFAULT'].get('SignOfLifeLog')
+
+        # poll intervals are given in milliseconds in config.ini, the scheduler works in seconds
+        polling = parser['POLLING'] if parser.has_section('POLLING') else parser['DEFAULT']
+        polling_settings = {
+            'charging_interval': polling.getint('ChargingInterval', fallback=250) / 1000.0,
+            'connected_interval': polling.getint('ConnectedInterval', fallback=1000) / 1000.0,
+            'idle_interval': polling.getint('IdleInterval', fallback=5000) / 1000.0,
+            'boost_interval': polling.getint('BoostInterval', fallback=250) / 1000.0,
+            'boost_duration': polling.getint('BoostDuration', fallback=10000) / 1000.0,
+            'backoff_start': polling.getint('BackoffStart', fallback=1000) / 1000.0,
+            'backoff_max': polling.getint('BackoffMax', fallback=60000) / 1000.0,
+            'jitter': polling.getfloat('Jitter', fallback=0.2),
+        }
+        if min(polling_settings.values()) < 0:
+            raise ValueError("[POLLING] values must not be negative")
+
+        # circuit breaker per host: after FailureThreshold failed requests only probe it
+        health_settings = {
+            'failure_threshold': polling.getint('FailureThreshold', fallback=3),
+            'probe_interval': polling.getint('ProbeInterval', fallback=10000) / 1000.0,
+            'probe_max': polling.getint('ProbeMax', fallback=300000) / 1000.0,
+            'jitter': polling_settings['jitter'],
+        }
+        if health_settings['failure_threshold'] < 1 or health_settings['probe_interval'] <= 0:
+            raise ValueError("FailureThreshold and ProbeInterval must be positive")
+
+        # the EM only holds slowly changing settings, it gets its own slow poll
+        em_interval = polling.getint('EMInterval', fallback=30000) / 1000.0
+        em_cache_ttl = polling.getint('EMCacheTTL', fallback=120000) / 1000.0
+        if em_interval <= 0 or em_cache_ttl <= 0:
+            raise ValueError("EMInterval and EMCacheTTL must be positive")
+
+        # optional per-path deadbands, e.g. /Ac/Power=5
+        deadbands = {}
+        if parser.has_section('DEADBANDS'):
+            defaults = parser.defaults()
+            for path, band in parser.items('DEADBANDS'):
+                if path in defaults:
+                    continue
+                if not path.startswith('/'):
+                    raise ValueError("Deadband key %s is not a D-Bus path" % (path))
+                deadbands[path] = float(band)
+
+        # charge history, files are kept per charger under Path (empty: RAM only)
+        history = parser['HISTORY'] if parser.has_section('HISTORY') else parser['DEFAULT']
+        history_settings = {
+            'path': history.get('Path', '/data/dbus-lektrico-evcharger').strip() or None,
+            'ticks': history.getint('TickBuffer', fallback=3600),
+            'seconds': history.getint('SecondsTier', fallback=21600),
+            'minutes': history.getint('MinutesTier', fallback=43200),
+            'flush_interval': history.getint('FlushInterval', fallback=300),
+        }
+        if min(value for key, value in history_settings.items() if key != 'path') <= 0:
+            raise ValueError("[HISTORY] sizes and FlushInterval must be positive")
+
+        # optional solar surplus control while /Mode is Auto
+        surplus = parser['SURPLUS'] if parser.has_section('SURPLUS') else parser['DEFAULT']
+        surplus_enabled = surplus.getboolean('Enabled', fallback=False)
+        surplus_settings = {
+            'hysteresis': surplus.getfloat('Hysteresis', fallback=1.0),
+            'ramp_up': surplus.getfloat('RampUp', fallback=1.0),
+            'ramp_down': surplus.getfloat('RampDown', fallback=4.0),
+            'battery_first': surplus.getboolean('BatteryFirst', fallback=True),
+        }
+        surplus_min_current = surplus.getint('MinCurrent', fallback=6)
+        if min(surplus_settings['hysteresis'], surplus_settings['ramp_up'], surplus_settings['ramp_down']) <= 0:
+            raise ValueError("[SURPLUS] Hysteresis, RampUp and RampDown must be positive")
+        if surplus_enabled and len(chargers) > 1:
+            # every charger would claim the whole grid export for itself
+            raise ValueError("[SURPLUS] Enabled=1 works with one charger only, %d are configured" % (len(chargers)))
+
+        # current.log is rotated by size, repeated warnings/errors are written once per RepeatWindow
+        logs = parser['LOGGING'] if parser.has_section('LOGGING') else parser['DEFAULT']
+        log_settings = {
+            'max_bytes': logs.getint('MaxSize', fallback=512) * 1024,
+            'backups': logs.getint('Backups', fallback=2),
+            'repeat_window': logs.getfloat('RepeatWindow', fallback=60),
+        }
+        if log_settings['max_bytes'] <= 0 or log_settings['backups'] < 0 or log_settings['repeat_window'] < 0:
+            raise ValueError("[LOGGING] MaxSize must be positive, Backups and RepeatWindow not negative")
+
+        # record mode for bench/replay.py: charger/EM traffic and D-Bus writes to Path (empty: off)
+        record = parser['RECORD'] if parser.has_section('RECORD') else parser['DEFAULT']
+        record_settings = {
+            'path': record.get('Path', '').strip() or None,
+            'max_bytes': record.getint('MaxSize', fallback=50) * 1024 * 1024,
+        }
+        if record_settings['max_bytes'] <= 0:
+            raise ValueError("[RECORD] MaxSize must be positive")
+
+        # charger_info over a websocket when the firmware has one: auto tries it once per firmware version
+        push = onpremise.get('Push', 'auto').strip().lower()
+        if push not in ('auto', 'on', 'off'):
+            raise ValueError("Push must be auto, on or off")
+
+        # everything parsed fine, switch over in one go
+        self.access_type = access_type
+        self.sign_of_life_log = int(sign_of_life) if sign_of_life else 0
+        self.chargers = chargers
+        self.em_host = em_host
+        self.pool_size = onpremise.getint('PoolSize', fallback=2)
+        self.connect_timeout = onpremise.getfloat('ConnectTimeout', fallback=2)
+        self.read_timeout = onpremise.getfloat('ReadTimeout', fallback=5)
+        self.command_timeout = onpremise.getfloat('CommandTimeout', fallback=10)
+        self.current_write_interval = onpremise.getfloat('CurrentWriteInterval', fallback=1)
+        self.push = push
+        self.push_keepalive = onpremise.getfloat('PushKeepalive', fallback=30)
+        self.push_interval = polling.getint('PushInterval', fallback=60000) / 1000.0
+        self.static_cache = onpremise.get('StaticCache', '/data/dbus-lektrico-evcharger/static.json').strip() or None
+        self.polling = polling_settings
+        self.health = health_settings
+        self.em_interval = em_interval
+        self.em_cache_ttl = em_cache_ttl
+        self.deadbands = deadbands
+        self.history = history_settings
+        self.surplus_enabled = surplus_enabled
+        self.surplus = surplus_settings
+        self.surplus_min_current = surplus_min_current
+        self.logs = log_settings
+        self.record = record_settings
+
+        self.em_status_url = "http://%s/rpc/app_config.get" % (em_host)
+        self.em_rpc_url = "http://%s/rpc" % (em_host)
+
+        self._mtime = mtime
+
+    def reload_if_changed(self, force=False):
+        """Reload when the file mtime changed (or force is set). Returns True if a new config was applied."""
+        if not force and self._get_mtime() == self._mtime:
+            return False
+
+        try:
+            self.load()
+        except Exception as e:
+            # keep running with the last good config
+            logging.error("Not reloading %s: %s" % (self.path, e))
+            self._mtime = self._get_mtime()
+            return False
+
+        logging.info("Reloaded %s (Hosts=%s, EM_Host=%s)" % (
+            self.path, ', '.join(c.host for c in self.chargers.values()), self.em_host))
+        return True
+
+    def charger(self, name):
+        return self.chargers.get(name)
+
+    def _parse_chargers(self, parser):
+        chargers = {}
+        for section in parser.sections():
+            if not section.startswith(CHARGER_SECTION_PREFIX):
+                continue
+            name = section[len(CHARGER_SECTION_PREFIX):]
+            settings = parser[section]
+            if not settings.get('Host'):
+                raise ValueError("Host must be set in [%s]" % (section))
+            chargers[name] = ChargerConfig(
+                name, settings['Host'], settings.getint('Deviceinstance'), settings.getint('HardwareVersion'),
+                settings.get('ProductName', 'Lektri.co 1p7k'), self._parse_phases(settings, section))
+
+        if not chargers:
+            # single charger setup: Host in [ONPREMISE], Deviceinstance in [DEFAULT]
+            host = parser['ONPREMISE'].get('Host')
+            if not host:
+                raise ValueError("Host must be set in [ONPREMISE] or a [CHARGER:x] section")
+            chargers['default'] = ChargerConfig(
+                'default', host, parser['DEFAULT'].getint('Deviceinstance'),
+                parser['DEFAULT'].getint('HardwareVersion'), parser['DEFAULT'].get('ProductName', 'Lektri.co 1p7k'),
+                self._parse_phases(parser['DEFAULT'], 'DEFAULT'))
+
+        instances = [c.device_instance for c in chargers.values()]
+        if len(set(instances)) != len(instances):
+            raise ValueError("Every charger needs its own Deviceinstance")
+
+        return chargers
+
+    def _parse_phases(self, settings, section):
+        phases = settings.get('Phases', 'auto').strip().lower()
+        if phases == 'auto':
+            return None
+        if phases not in ('1', '3'):
+            raise ValueError("Phases in [%s] must be 1, 3 or auto" % (section))
+        return int(phases)
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
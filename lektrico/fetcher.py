@@ -0,0 +1,44 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FetchEngine:
+    """Runs blocking HTTP fetches on worker threads and hands the results back to the main loop"""
+
+    def __init__(self, idle_add, workers=2):
+        # idle_add is GLib.idle_add (or a stand-in), the only thread-safe way back into the main loop
+        self._idle_add = idle_add
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lektrico-fetch')
+
+    def submit(self, jobs, callback):
+        """Run all jobs concurrently, then call callback(results, errors) once on the main loop.
+
+        jobs is a dict name -> callable, results and errors are dicts keyed by the same names.
+        """
+        results = {}
+        errors = {}
+        pending = [len(jobs)]
+        lock = threading.Lock()
+
+        def deliver():
+            callback(results, errors)
+            return False  # run once
+
+        def done(name, future):
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                errors[name] = e
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                self._idle_add(deliver)
+
+        if not jobs:
+            self._idle_add(deliver)
+            return
+
+        for name, job in jobs.items():
+            future = self._executor.submit(job)
+            future.add_done_callback(lambda f, name=name: done(name, f))
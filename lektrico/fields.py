@@ -0,0 +1,60 @@
+class Field:
+    """How one D-Bus path is filled from a charger_info key, shown (fmt) and filtered (deadband)
+
+    key None means the path is not a plain copy of one key and is filled by the service itself.
+    Optional fields (required=False) are skipped when the key is missing, e.g. on older firmware.
+    mapping translates the raw value (as str) instead of converting it, unknown values give default.
+    """
+
+    def __init__(self, path, key=None, type=int, scale=1, fmt='%s', deadband=None, required=True, mapping=None,
+                 default=None, initial=0, writeable=True):
+        self.path = path
+        self.key = key
+        self.type = type
+        self.scale = scale
+        self.fmt = fmt
+        self.deadband = deadband
+        self.required = required
+        self.mapping = mapping
+        self.default = default
+        self.initial = initial
+        self.writeable = writeable
+        self.textformat = formatter(fmt)
+
+
+def formatter(fmt):
+    """GetText callback for a precompiled format string like '%.1fA'"""
+    def textformat(path, value):
+        return fmt % value if value is not None else ''
+    return textformat
+
+
+def deadbands(fields):
+    return dict((field.path, field.deadband) for field in fields if field.deadband)
+
+
+def compile_fields(fields):
+    """Compile the table into one function data -> {path: value}, straight-line code without per-field lookups"""
+    env = {}
+    lines = ['def convert(data):', '    values = {}']
+    for i, field in enumerate(fields):
+        if field.key is None:
+            continue
+        if field.mapping is not None:
+            env['mapping_%d' % i] = field.mapping
+            expression = 'mapping_%d.get(str(raw), %r)' % (i, field.default)
+        else:
+            env['type_%d' % i] = field.type
+            expression = 'type_%d(raw * %r)' % (i, field.scale) if field.scale != 1 else 'type_%d(raw)' % (i)
+
+        if field.required:
+            lines.append('    raw = data[%r]' % (field.key))
+            lines.append('    values[%r] = %s' % (field.path, expression))
+        else:
+            lines.append('    raw = data.get(%r)' % (field.key))
+            lines.append('    if raw is not None:')
+            lines.append('        values[%r] = %s' % (field.path, expression))
+    lines.append('    return values')
+
+    exec(compile('\n'.join(lines), '<charger fields>', 'exec'), env)
+    return env['convert']
@@ -0,0 +1,89 @@
+import logging
+import random
+import threading
+
+import requests
+
+from .clock import SYSTEM_CLOCK
+
+UNKNOWN = 'unknown'
+ONLINE = 'online'
+DEGRADED = 'degraded'
+OFFLINE = 'offline'
+PROBING = 'probing'
+
+
+class HostOffline(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request while the circuit of a host is open"""
+
+
+class HostHealth:
+    """Connection health of one host: online -> degraded -> offline (circuit open) -> probing -> online
+
+    A host starts as unknown, which doesn't count as connected until it has answered once.
+    After failure_threshold failed requests in a row nothing is sent to the host any more, except a
+    single probe every probe_interval seconds (doubled after every failed probe, up to probe_max).
+    Safe to use from the fetch and command threads.
+    """
+
+    def __init__(self, host, failure_threshold=3, probe_interval=10.0, probe_max=300.0, jitter=0.2, clock=SYSTEM_CLOCK):
+        self.host = host
+        self._clock = clock
+        self.configure(failure_threshold, probe_interval, probe_max, jitter)
+        self.state = UNKNOWN
+        self.failures = 0
+        self._probe_at = 0
+        self._lock = threading.Lock()
+
+    def configure(self, failure_threshold, probe_interval, probe_max, jitter):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        self.probe_max = probe_max
+        self.jitter = jitter
+        self._probe_delay = probe_interval
+
+    @property
+    def connected(self):
+        return self.state in (ONLINE, DEGRADED)
+
+    def allow(self):
+        """True if a request may go out now, in probing state only one at a time"""
+        with self._lock:
+            if self.state in (UNKNOWN, ONLINE, DEGRADED):
+                return True
+            if self.state == PROBING or self._clock.monotonic() < self._probe_at:
+                return False
+            self.state = PROBING
+            logging.debug("Probing %s" % (self.host))
+            return True
+
+    def success(self):
+        with self._lock:
+            if self.state in (OFFLINE, PROBING):
+                logging.info("%s is back online after %d failed requests" % (self.host, self.failures))
+            self.state = ONLINE
+            self.failures = 0
+            self._probe_delay = self.probe_interval
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == PROBING:
+                self._probe_delay = min(self.probe_max, self._probe_delay * 2)
+                self._open()
+            elif self.state != OFFLINE and self.failures >= self.failure_threshold:
+                logging.warning("%s is offline after %d failed requests, probing every %gs" % (
+                    self.host, self.failures, self._probe_delay))
+                self._open()
+            elif self.state == ONLINE:
+                self.state = DEGRADED
+
+    def _open(self):
+        self.state = OFFLINE
+        self._probe_at = self._clock.monotonic() + self._probe_delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def retry_in(self):
+        """Seconds until the next probe may go out, 0 unless the circuit is open"""
+        if self.state != OFFLINE:
+            return 0
+        return max(0, self._probe_at - self._clock.monotonic())
@@ -0,0 +1,283 @@
+"""Fixed-size charge history: raw ticks in RAM, 1 s and 1 min averages in a memory-mapped file
+
+Inspect a history file (also while the service is running, up to its last flush):
+
+    python -m lektrico.history /data/dbus-lektrico-evcharger/history-default.bin [session_id]
+"""
+
+import array
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+# file header: magic, version, capacity of the 1 s tier, capacity of the 1 min tier
+HEADER = struct.Struct('<4sIII')
+MAGIC = b'LKHS'
+VERSION = 1
+
+# per tier: index of the next slot, number of valid slots
+TIER_HEADER = struct.Struct('<II')
+
+# one sample: unix time (start of the interval), session_id, power W, current A, session energy Wh
+SAMPLE = struct.Struct('<dIfff')
+
+
+class _Tier:
+    """Ring of samples inside a shared buffer (mmap or bytearray), oldest sample is overwritten first"""
+
+    def __init__(self, buffer, offset, capacity):
+        self._buffer = buffer
+        self._offset = offset
+        self._data = offset + TIER_HEADER.size
+        self.capacity = capacity
+        self.head, self.count = TIER_HEADER.unpack_from(buffer, offset)
+        if self.head >= capacity or self.count > capacity:
+            self.head = self.count = 0
+
+    @staticmethod
+    def size(capacity):
+        return TIER_HEADER.size + capacity * SAMPLE.size
+
+    def append(self, sample):
+        SAMPLE.pack_into(self._buffer, self._data + self.head * SAMPLE.size, *sample)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        TIER_HEADER.pack_into(self._buffer, self._offset, self.head, self.count)
+
+    def samples(self):
+        """All samples, oldest first"""
+        start = (self.head - self.count) % self.capacity
+        for i in range(self.count):
+            yield SAMPLE.unpack_from(self._buffer, self._data + (start + i) % self.capacity * SAMPLE.size)
+
+
+class _Bucket:
+    """Averages samples over fixed intervals (width seconds), one result per interval and session"""
+
+    def __init__(self, width):
+        self.width = width
+        self._key = None
+        self._session_id = None
+        self._n = 0
+        self._power = 0.0
+        self._current = 0.0
+        self._energy = 0.0
+
+    def add(self, timestamp, session_id, power, current, energy):
+        """Returns the finished sample of the previous interval, or None"""
+        key = int(timestamp // self.width)
+        done = None
+        if key != self._key or session_id != self._session_id:
+            done = self.flush()
+            self._key = key
+            self._session_id = session_id
+        self._n += 1
+        self._power += power
+        self._current += current
+        self._energy = energy
+        return done
+
+    def flush(self):
+        if not self._n:
+            return None
+        sample = (self._key * self.width, self._session_id, self._power / self._n, self._current / self._n,
+                  self._energy)
+        self._n = 0
+        self._power = self._current = 0.0
+        return sample
+
+
+class SessionHistory:
+    """Per-tick snapshots of one charger, downsampled to 1 s and 1 min tiers keyed by session_id
+
+    Memory use is fixed: ticks live in RAM only, the two tiers in a memory-mapped file (or in RAM
+    when path is None). New tier samples are collected in RAM and copied into the file every
+    flush_interval seconds, so the flash sees one small write burst per interval, not one per tick.
+    """
+
+    def __init__(self, path=None, ticks=3600, seconds=21600, minutes=43200, flush_interval=300):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        # raw ticks, column-wise so they take no per-sample objects
+        self._ticks = ticks
+        self._tick_head = 0
+        self._tick_count = 0
+        self._tick_time = array.array('d', bytes(8 * ticks))
+        self._tick_session = array.array('L', [0] * ticks)
+        self._tick_power = array.array('f', bytes(4 * ticks))
+        self._tick_current = array.array('f', bytes(4 * ticks))
+        self._tick_energy = array.array('f', bytes(4 * ticks))
+
+        size = HEADER.size + _Tier.size(seconds) + _Tier.size(minutes)
+        self._file = None
+        self._buffer = self._open(path, size, seconds, minutes) if path else bytearray(size)
+        self._seconds = _Tier(self._buffer, HEADER.size, seconds)
+        self._minutes = _Tier(self._buffer, HEADER.size + _Tier.size(seconds), minutes)
+
+        self._second_bucket = _Bucket(1)
+        self._minute_bucket = _Bucket(60)
+        self._pending = []  # (tier, sample) not yet copied into the buffer
+        self._last_flush = time.monotonic()
+
+    def _open(self, path, size, seconds, minutes):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            header = os.read(fd, HEADER.size)
+            expected = HEADER.pack(MAGIC, VERSION, seconds, minutes)
+            if header != expected or os.fstat(fd).st_size != size:
+                # new file or other tier sizes: start over
+                if header:
+                    logging.warning("History %s has another layout, starting a new one" % (path))
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+                os.pwrite(fd, expected, 0)
+            self._file = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        return self._file
+
+    def add(self, timestamp, session_id, power, current, energy):
+        """One charger_info snapshot: power in W, current in A, session energy in Wh"""
+        i = self._tick_head
+        self._tick_time[i] = timestamp
+        self._tick_session[i] = session_id
+        self._tick_power[i] = power
+        self._tick_current[i] = current
+        self._tick_energy[i] = energy
+        self._tick_head = (i + 1) % self._ticks
+        self._tick_count = min(self._tick_count + 1, self._ticks)
+
+        second = self._second_bucket.add(timestamp, session_id, power, current, energy)
+        if second is not None:
+            self._pending.append((self._seconds, second))
+            minute = self._minute_bucket.add(*second)
+            if minute is not None:
+                self._pending.append((self._minutes, minute))
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Copy the collected samples into the file"""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        for tier, sample in self._pending:
+            tier.append(sample)
+        self._pending = []
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        # the intervals still being averaged are written as they are
+        second = self._second_bucket.flush()
+        if second is not None:
+            self._pending.append((self._seconds, second))
+            minute = self._minute_bucket.add(*second)
+            if minute is not None:
+                self._pending.append((self._minutes, minute))
+        minute = self._minute_bucket.flush()
+        if minute is not None:
+            self._pending.append((self._minutes, minute))
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def ticks(self, session_id=None):
+        """Raw (time, session_id, power, current, energy) snapshots still in RAM, oldest first"""
+        start = (self._tick_head - self._tick_count) % self._ticks
+        for n in range(self._tick_count):
+            i = (start + n) % self._ticks
+            if session_id is None or self._tick_session[i] == session_id:
+                yield (self._tick_time[i], self._tick_session[i], self._tick_power[i], self._tick_current[i],
+                       self._tick_energy[i])
+
+    def _samples(self, tier):
+        for sample in tier.samples():
+            yield sample
+        for pending_tier, sample in self._pending:
+            if pending_tier is tier:
+                yield sample
+
+    def sessions(self):
+        """{session_id: {'start', 'end', 'energy_wh'}} of every session still in the 1 min or 1 s tier"""
+        sessions = {}
+        for tier in (self._minutes, self._seconds):
+            for timestamp, session_id, power, current, energy in self._samples(tier):
+                session = sessions.setdefault(session_id, {'start': timestamp, 'end': timestamp, 'energy_wh': 0.0})
+                session['start'] = min(session['start'], timestamp)
+                session['end'] = max(session['end'], timestamp)
+                session['energy_wh'] = max(session['energy_wh'], energy)
+        return sessions
+
+    def session(self, session_id):
+        """Power curve and energy totals of one session, from the finest tier that still holds all of it
+
+        Returns None for unknown sessions. energy_wh is the charger's own counter, integrated_wh the
+        area under the stored power curve.
+        """
+        seconds = [s for s in self._samples(self._seconds) if s[1] == session_id]
+        minutes = [s for s in self._samples(self._minutes) if s[1] == session_id]
+        if seconds and (not minutes or seconds[0][0] < minutes[0][0] + 60):
+            samples, resolution = seconds, 1
+        else:
+            samples, resolution = minutes, 60
+        if not samples:
+            return None
+
+        integrated = 0.0
+        for sample, following in zip(samples, samples[1:] + [None]):
+            duration = min(following[0] - sample[0], resolution) if following else resolution
+            integrated += sample[2] * duration / 3600.0
+
+        return {
+            'session_id': session_id,
+            'start': samples[0][0],
+            'end': samples[-1][0] + resolution,
+            'resolution': resolution,
+            'energy_wh': max(s[4] for s in samples),
+            'integrated_wh': round(integrated, 1),
+            'power': [(s[0], round(s[2], 1)) for s in samples],
+        }
+
+
+def main(argv):
+    if len(argv) not in (2, 3):
+        print("Usage: %s <history file> [session_id]" % (argv[0]))
+        return 2
+
+    with open(argv[1], 'rb') as f:
+        magic, version, seconds, minutes = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        print("%s is not a history file" % (argv[1]))
+        return 1
+
+    # read-only copy, the service keeps writing to the file
+    history = SessionHistory(None, ticks=1, seconds=seconds, minutes=minutes)
+    with open(argv[1], 'rb') as f:
+        history._buffer[:] = f.read()
+    history._seconds = _Tier(history._buffer, HEADER.size, seconds)
+    history._minutes = _Tier(history._buffer, HEADER.size + _Tier.size(seconds), minutes)
+
+    if len(argv) == 3:
+        print(json.dumps(history.session(int(argv[2])), indent=2))
+    else:
+        for session_id, session in sorted(history.sessions().items(), key=lambda item: item[1]['start']):
+            print("%d  %s - %s  %.2f kWh" % (
+                session_id, time.strftime('%Y-%m-%d %H:%M', time.localtime(session['start'])),
+                time.strftime('%H:%M', time.localtime(session['end'])), session['energy_wh'] / 1000.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,170 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s'
+LOG_DATEFMT = '%Y-%m-%d %H:%M:%S'
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the log thread without blocking, drops them when the queue is full
+
+    Only the message is resolved here, formatting and tracebacks are done by the log thread.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RepeatFilter:
+    """Writes a warning/error once per window, repeats within the window are only counted
+
+    A record repeats another one when level, logger, message and exception text are the same.
+    When the window ends, one "repeated N times" line replaces all the repeats.
+    """
+
+    def __init__(self, window=60.0, level=logging.WARNING):
+        self.window = window
+        self.level = level
+        self._seen = {}  # key -> [first time, repeats, record]
+
+    @staticmethod
+    def _key(record):
+        exc = record.exc_info[1] if record.exc_info else None
+        return record.levelno, record.name, record.msg, type(exc).__name__ if exc else None, str(exc) if exc else None
+
+    def check(self, record):
+        """True if the record should be written"""
+        if record.levelno < self.level or self.window <= 0:
+            return True
+        key = self._key(record)
+        seen = self._seen.get(key)
+        if seen is not None and record.created - seen[0] < self.window:
+            seen[1] += 1
+            return False
+        self._seen[key] = [record.created, 0, record]
+        return True
+
+    def expired(self, now):
+        """Summary records for every repeated message whose window has ended"""
+        summaries = []
+        for key, (first, repeats, record) in list(self._seen.items()):
+            if now - first < self.window:
+                continue
+            del self._seen[key]
+            if repeats:
+                summaries.append(self._summary(record, repeats, now))
+        return summaries
+
+    def flush(self, now):
+        summaries = [self._summary(record, repeats, now) for _, repeats, record in self._seen.values() if repeats]
+        self._seen.clear()
+        return summaries
+
+    @staticmethod
+    def _summary(record, repeats, now):
+        summary = logging.makeLogRecord({
+            'name': record.name, 'levelno': record.levelno, 'levelname': record.levelname,
+            'msg': "%s [repeated %d times in %.0fs]" % (record.msg, repeats, now - record.created)})
+        summary.created = now
+        summary.msecs = (now - int(now)) * 1000
+        return summary
+
+
+class LogPipeline:
+    """Log records go through a bounded queue to one background thread that writes them
+
+    The main loop never waits for the disk, the file is rotated by size and repeated warnings and
+    errors are collapsed by RepeatFilter. stop() writes what is still queued.
+    """
+
+    STOP = object()
+
+    def __init__(self, handlers, repeat_window=60.0, queue_size=1000, flush_interval=5.0):
+        self._handlers = handlers
+        self._filter = RepeatFilter(repeat_window)
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(queue_size)
+        self.handler = QueueHandler(self._queue)
+        self._reported_drops = 0
+        self._thread = threading.Thread(target=self._run, name='lektrico-log')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def configure(self, max_bytes, backups, repeat_window):
+        # picked up by the log thread with the next record, nothing is reopened
+        for handler in self._handlers:
+            if isinstance(handler, logging.handlers.RotatingFileHandler):
+                handler.maxBytes = max_bytes
+                handler.backupCount = backups
+        self._filter.window = repeat_window
+
+    def stop(self, timeout=5.0):
+        try:
+            self._queue.put(self.STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        for handler in self._handlers:
+            handler.close()
+
+    def _write(self, record):
+        for handler in self._handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _run(self):
+        while True:
+            try:
+                record = self._queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                record = None
+            now = time.time()
+
+            if record is self.STOP:
+                for summary in self._filter.flush(now):
+                    self._write(summary)
+                return
+
+            for summary in self._filter.expired(now):
+                self._write(summary)
+
+            dropped = self.handler.dropped
+            if dropped != self._reported_drops:
+                self._write(logging.makeLogRecord({
+                    'name': 'root', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': "%d log messages dropped, the log queue was full" % (dropped - self._reported_drops)}))
+                self._reported_drops = dropped
+
+            if record is not None and self._filter.check(record):
+                self._write(record)
+
+
+def setup_logging(path, max_bytes=512 * 1024, backups=2, repeat_window=60.0, level=logging.INFO):
+    """Root logger to path (rotated by size) and stderr, both written by a background thread"""
+    formatter = logging.Formatter(LOG_FORMAT, LOG_DATEFMT)
+    handlers = [logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups),
+                logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    pipeline = LogPipeline(handlers, repeat_window).start()
+    logging.basicConfig(level=level, handlers=[pipeline.handler])
+    return pipeline
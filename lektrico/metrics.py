@@ -0,0 +1,66 @@
+import bisect
+import threading
+
+# upper bounds of the latency buckets in ms, everything slower ends up in the last (overflow) bucket
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Fixed-size latency histogram (ms), cumulative since start"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (never above the real max)"""
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                bound = BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max
+                return min(float(bound), self.max)
+        return self.max
+
+
+class Metrics:
+    """Counters and latency histograms, safe to update from the fetch and command threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.add(seconds * 1000.0)
+
+    def counter(self, name):
+        return self._counters.get(name, 0)
+
+    def histogram(self, name):
+        return self._histograms.get(name) or Histogram()
+
+    def summary(self, name):
+        """One line for the sign of life log, e.g. 'charger_info n=120 p50=10ms p99=50ms max=61ms err=0 timeout=0'"""
+        histogram = self.histogram(name)
+        return "%s n=%d p50=%.0fms p99=%.0fms max=%.0fms err=%d timeout=%d" % (
+            name, histogram.count, histogram.percentile(50), histogram.percentile(99), histogram.max,
+            self.counter(name + '.errors'), self.counter(name + '.timeouts'))
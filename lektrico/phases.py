@@ -0,0 +1,33 @@
+def _padded(values, first):
+    # charger_info has 3-element arrays, older firmware may only report the L1 scalar
+    values = list(values or [first])
+    return (values + [0, 0, 0])[:3]
+
+
+def detect_phases(data):
+    """3 if the charger reports voltage on L2 or L3 (3p units do, even when idle), 1 otherwise
+
+    install_current can't tell them apart: it is the per-phase limit of the installation, 32 A on a
+    1p7k as well as on a 3p22k.
+    """
+    voltages = _padded(data.get('voltages'), data.get('voltage', 0))
+    return 3 if voltages[1] > 0 or voltages[2] > 0 else 1
+
+
+def phase_values(data, phases):
+    """Per-phase current, voltage and power from one charger_info snapshot, as three lists for L1..L3
+
+    The power of each phase is current * voltage, scaled so that the phases add up to instant_power
+    (which includes the power factor). On 1p chargers L1 simply gets instant_power.
+    """
+    power = float(data['instant_power'])
+    currents = _padded(data.get('currents'), data['current'])
+    voltages = _padded(data.get('voltages'), data['voltage'])
+
+    if phases == 1:
+        return [currents[0], 0, 0], [voltages[0], 0, 0], [power, 0, 0]
+
+    apparent = [c * v for c, v in zip(currents, voltages)]
+    total = sum(apparent)
+    scale = power / total if total else 0
+    return currents, voltages, [p * scale for p in apparent]
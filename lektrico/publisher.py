@@ -0,0 +1,35 @@
+class DiffPublisher:
+    """Writes a snapshot of values to a VeDbusService, touching only the paths whose value really changed"""
+
+    def __init__(self, dbusservice, deadbands=None):
+        self._dbusservice = dbusservice
+        self.set_deadbands(deadbands or {})
+
+    def set_deadbands(self, deadbands):
+        # config.ini lower-cases option names, so match paths case-insensitively
+        self._deadbands = dict((path.lower(), float(band)) for path, band in deadbands.items())
+
+    def publish(self, values):
+        """Publish a dict path -> value, returns the list of paths that were written"""
+        changed = []
+        for path, value in values.items():
+            if self._changed(path, self._dbusservice[path], value):
+                self._dbusservice[path] = value
+                changed.append(path)
+        return changed
+
+    def _changed(self, path, old, new):
+        if old == new:
+            return False
+        if old is None or new is None or isinstance(new, str) or isinstance(old, str):
+            return True
+
+        deadband = self._deadbands.get(path.lower())
+        if not deadband:
+            return True
+
+        # always let a drop to zero through, e.g. power when charging stops
+        if new == 0:
+            return True
+
+        return abs(new - old) > deadband
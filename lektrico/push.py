@@ -0,0 +1,214 @@
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+
+# RFC 6455 handshake constant
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+class PushNotSupported(Exception):
+    """The charger answered, but has no websocket on /rpc (older firmware)"""
+
+
+class WebSocket:
+    """Minimal websocket client (RFC 6455, text frames only), enough for JSON-RPC notifications
+
+    Venus OS ships no websocket library, this only needs the standard library.
+    """
+
+    def __init__(self, host, path='/rpc', timeout=5.0):
+        hostname, _, port = host.partition(':')
+        self._sock = socket.create_connection((hostname, int(port or 80)), timeout)
+        self._buffer = b''
+        try:
+            self._handshake(host, path)
+        except Exception:
+            self._sock.close()
+            raise
+
+    def _handshake(self, host, path):
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self._sock.sendall((
+            "GET %s HTTP/1.1\r\nHost: %s\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n" % (path, host, key)).encode('ascii'))
+
+        while b'\r\n\r\n' not in self._buffer:
+            chunk = self._sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("Connection closed during websocket handshake")
+            self._buffer += chunk
+        head, self._buffer = self._buffer.split(b'\r\n\r\n', 1)
+        lines = head.decode('latin-1').split('\r\n')
+
+        status = lines[0].split(' ', 2)
+        if len(status) < 2 or status[1] != '101':
+            raise PushNotSupported("No websocket on %s%s: %s" % (host, path, lines[0]))
+
+        headers = dict((name.strip().lower(), value.strip()) for name, _, value in
+                       (line.partition(':') for line in lines[1:]))
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        if headers.get('sec-websocket-accept') != accept:
+            raise ConnectionError("Invalid websocket handshake from %s" % (host))
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def _read(self, n):
+        while len(self._buffer) < n:
+            chunk = self._sock.recv(max(4096, n - len(self._buffer)))
+            if not chunk:
+                raise ConnectionError("Websocket closed by peer")
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def _send_frame(self, opcode, payload):
+        # client frames are always masked
+        header = bytearray([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack('>H', length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack('>Q', length)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self._sock.sendall(bytes(header) + mask + masked)
+
+    def send(self, text):
+        self._send_frame(OPCODE_TEXT, text.encode('utf-8'))
+
+    def recv(self):
+        """Next text message, answers pings on the way. socket.timeout if nothing arrives in time."""
+        message = b''
+        while True:
+            first, second = self._read(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', self._read(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self._read(8))[0]
+            mask = self._read(4) if second & 0x80 else None
+            payload = self._read(length)
+            if mask:
+                payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+            if opcode == OPCODE_PING:
+                self._send_frame(OPCODE_PONG, payload)
+            elif opcode == OPCODE_CLOSE:
+                raise ConnectionError("Websocket closed by peer")
+            elif opcode in (OPCODE_TEXT, OPCODE_CONTINUATION):
+                message += payload
+                if first & 0x80:
+                    return message.decode('utf-8')
+
+    def close(self):
+        try:
+            self._send_frame(OPCODE_CLOSE, b'')
+        except (OSError, socket.error):
+            pass
+        self._sock.close()
+
+
+class PushChannel:
+    """charger_info pushed by the charger over a websocket JSON-RPC channel
+
+    The channel asks for charger_info.get once, then merges the NotifyStatus notifications into
+    that snapshot and hands every new snapshot to on_snapshot(data) on the main loop. When nothing
+    arrives for keepalive seconds it asks for a full charger_info again, and closes the channel if
+    that isn't answered within another keepalive seconds. When the channel ends,
+    on_closed(error) is called once on the main loop, PushNotSupported meaning the firmware has
+    no push channel at all.
+    """
+
+    def __init__(self, host, idle_add, on_snapshot, on_closed, keepalive=30.0, connect_timeout=2.0):
+        self.host = host
+        self._idle_add = idle_add
+        self._on_snapshot = on_snapshot
+        self._on_closed = on_closed
+        self._keepalive = keepalive
+        self._connect_timeout = connect_timeout
+        self._websocket = None
+        self._ids = itertools.count(1)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='lektrico-push-%s' % (host))
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        websocket = self._websocket
+        if websocket is not None:
+            websocket.close()
+
+    def _request(self, method):
+        request_id = next(self._ids)
+        self._websocket.send(json.dumps({'src': 'VenusOS', 'id': request_id, 'method': method}))
+        return request_id
+
+    def _run(self):
+        error = None
+        try:
+            self._websocket = WebSocket(self.host, timeout=self._connect_timeout)
+            self._websocket.settimeout(self._keepalive)
+            logging.info("Push channel to %s open" % (self.host))
+
+            snapshot = None
+            request_id = self._request('charger_info.get')
+            deadline = time.monotonic() + self._keepalive  # for the answer, None once it came
+            while not self._stopped:
+                if deadline is not None and time.monotonic() >= deadline:
+                    # a half-open connection never raises by itself, give up so polling takes over
+                    raise ConnectionError("No answer to charger_info.get within %ss" % (self._keepalive))
+                try:
+                    message = json.loads(self._websocket.recv())
+                except socket.timeout:
+                    if deadline is None:
+                        request_id = self._request('charger_info.get')
+                        deadline = time.monotonic() + self._keepalive
+                    continue
+
+                if message.get('id') == request_id and isinstance(message.get('result'), dict):
+                    deadline = None
+                    snapshot = dict(message['result'])
+                elif message.get('method') in ('NotifyStatus', 'NotifyFullStatus') and snapshot is not None:
+                    snapshot.update(message.get('params') or {})
+                else:
+                    continue
+                self._idle_add(self._deliver, dict(snapshot))
+        except Exception as e:
+            error = e
+        finally:
+            if self._websocket is not None:
+                self._websocket.close()
+        if not self._stopped:
+            self._idle_add(self._closed, error)
+
+    def _deliver(self, snapshot):
+        if not self._stopped:
+            self._on_snapshot(snapshot)
+        return False
+
+    def _closed(self, error):
+        self._on_closed(error)
+        return False
@@ -0,0 +1,340 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from .clock import Clock
+from .transport import HttpTransport
+
+RECORD_VERSION = 1
+
+
+class Recorder:
+    """Charger/EM traffic and D-Bus writes, appended to a file for bench/replay.py
+
+    Every start of the service adds a header line {"version", "start", "config"}, then one JSON
+    array per event with the time in ms since that start:
+
+        [ms, "g", url, response]              full GET response
+        [ms, "d", url, changed(, removed)]    GET response as changes against the previous one
+        [ms, "e", url, error]                 failed GET
+        [ms, "p", url, payload, answer(, error)]  RPC sent and its answer
+        [ms, "w", path, value, charger]       D-Bus write from VRM/GX
+
+    A full response is written again every keyframe responses. Recording stops at max_bytes.
+    """
+
+    def __init__(self, path, config=None, max_bytes=50 * 1024 * 1024, keyframe=600, flush_interval=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._keyframe = keyframe
+        self._flush_interval = flush_interval
+        self._previous = {}  # url -> last response, deltas are taken against it
+        self._since_keyframe = {}
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+        self._size = self._file.tell()
+        self._flushed = time.monotonic()
+        self._start = time.time()
+        self._write({'version': RECORD_VERSION, 'start': round(self._start, 3), 'config': config or {}})
+        logging.info("Recording charger traffic to %s" % (path))
+
+    def _ms(self):
+        return int((time.time() - self._start) * 1000)
+
+    def _write(self, event):
+        line = json.dumps(event, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._append(line)
+
+    def _append(self, line):
+        # called with the lock held
+        if self._file is None:
+            return
+        self._file.write(line)
+        self._size += len(line)
+        if self._size >= self.max_bytes:
+            logging.warning("Recording %s reached %d kB, stopped" % (self.path, self._size // 1024))
+            self._close()
+            return
+        now = time.monotonic()
+        if now - self._flushed >= self._flush_interval:
+            self._file.flush()
+            self._flushed = now
+
+    def response(self, url, data):
+        """A charger_info/charger_config/app_config answer, polled or pushed"""
+        with self._lock:
+            previous = self._previous.get(url)
+            count = self._since_keyframe.get(url, 0)
+            if isinstance(data, dict) and isinstance(previous, dict) and count < self._keyframe:
+                changed = dict((key, value) for key, value in data.items()
+                               if key not in previous or previous[key] != value)
+                removed = [key for key in previous if key not in data]
+                event = [self._ms(), 'd', url, changed] + ([removed] if removed else [])
+                self._since_keyframe[url] = count + 1
+            else:
+                event = [self._ms(), 'g', url, data]
+                self._since_keyframe[url] = 0
+            self._previous[url] = dict(data) if isinstance(data, dict) else data
+            self._append(json.dumps(event, separators=(',', ':')) + '\n')
+
+    def request(self, url, payload, response=None, error=None):
+        """One request of HttpTransport: GET when payload is None, else an RPC"""
+        if error is not None:
+            text = "%s: %s" % (type(error).__name__, error)
+            if payload is None:
+                self._write([self._ms(), 'e', url, text])
+            else:
+                self._write([self._ms(), 'p', url, payload, None, text])
+            return
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        if payload is not None:
+            status = response.status_code
+            self._write([self._ms(), 'p', url, payload, data] + (['HTTP %d' % status] if status >= 400 else []))
+        elif response.status_code >= 400:
+            self._write([self._ms(), 'e', url, 'HTTP %d' % response.status_code])
+        else:
+            self.response(url, data)
+
+    def write(self, charger, path, value):
+        self._write([self._ms(), 'w', path, value, charger])
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def load_recording(path):
+    """Segments of a recording, one (header, events) per start of the service, GET deltas expanded to full responses
+
+    Each start recorded its own config and time, so a file that spans a restart or reboot has to be
+    replayed segment by segment. Events are tuples (time, kind, where, data, extra) with the time in
+    seconds since the epoch and kind 'g' (response), 'e' (GET error), 'p' (RPC, extra is (answer, error))
+    or 'w' (D-Bus write, extra is the charger). A line cut off by a crash is skipped.
+    """
+    segments = []
+    events = None
+    start = None
+    responses = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+
+            if isinstance(event, dict):
+                events = []
+                segments.append((event, events))
+                start = event['start']
+                responses = {}
+                continue
+            if events is None:
+                continue
+
+            t = start + event[0] / 1000.0
+            kind, where = event[1], event[2]
+            if kind == 'd':
+                if where not in responses:
+                    continue
+                data = dict(responses[where])
+                data.update(event[3])
+                for key in (event[4] if len(event) > 4 else []):
+                    data.pop(key, None)
+                responses[where] = data
+                events.append((t, 'g', where, data, None))
+            elif kind == 'g':
+                responses[where] = event[3]
+                events.append((t, 'g', where, event[3], None))
+            elif kind == 'p':
+                events.append((t, 'p', where, event[3], (event[4], event[5] if len(event) > 5 else None)))
+            elif kind in ('e', 'w'):
+                events.append((t, kind, where, event[3], event[4] if len(event) > 4 else None))
+
+    # lines from different threads can be a few ms out of order
+    for header, events in segments:
+        events.sort(key=lambda event: event[0])
+    return segments
+
+
+def rpc_key(payload):
+    return payload.get('method', '') if isinstance(payload, dict) else ''
+
+
+class ReplayClock(Clock):
+    """Clock of a replay: the time is that of the replayed event and only moves on with advance()
+
+    Threads waiting on it (command deadlines, rate limit, SnapshotWaiter) are woken by every
+    advance() and check their deadline against the replayed time. settled() tells the replay
+    driver when all of them have seen the last advance(), waiting() how many are blocked on it.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.now = start
+        self._lock = threading.Lock()
+        self._generation = 0  # counts advance() calls
+        self._waiters = {}  # thread id -> generation it went to sleep in
+        self._conds = set()  # every condition waited on, advance() notifies them all
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now - self.start
+
+    def sleep(self, seconds):
+        cond = threading.Condition()
+        with cond:
+            self.wait_until(cond, self.monotonic() + seconds)
+
+    def advance(self, now=None):
+        """Move to now (only forward), or just wake every waiter so it checks again"""
+        with self._lock:
+            if now is not None and now > self.now:
+                self.now = now
+            self._generation += 1
+            conds = list(self._conds)
+        for cond in conds:
+            with cond:
+                cond.notify_all()
+
+    def wait_until(self, cond, deadline=None):
+        ident = threading.get_ident()
+        with self._lock:
+            # checked under the lock, so an advance() can't slip in between the check and the wait
+            if deadline is not None and self.monotonic() >= deadline:
+                return
+            self._conds.add(cond)
+            self._waiters[ident] = self._generation
+        try:
+            # in real time only as a safety net, advance() wakes us up
+            cond.wait(1.0)
+        finally:
+            with self._lock:
+                self._waiters.pop(ident, None)
+
+    def settled(self):
+        with self._lock:
+            return all(generation == self._generation for generation in self._waiters.values())
+
+    def waiting(self):
+        with self._lock:
+            return len(self._waiters)
+
+
+class ReplayResponse:
+    """What HttpTransport callers use of a requests.Response"""
+
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    __nonzero__ = __bool__
+
+    def json(self):
+        if self._data is None:
+            raise ValueError("No JSON in recorded response")
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError("%d (recorded)" % (self.status_code), response=self)
+
+
+class ReplayTransport(HttpTransport):
+    """HttpTransport that answers from a recording, nothing goes to the network
+
+    serve() makes the recorded GET answer of an event current for its URL, for the poll the
+    driver replays next (polling set). A GET outside a poll, like the EM read back after a mode
+    change, gets the next recorded answer for its URL instead, and that event ends up in taken.
+    An RPC gets the answer of the next recorded RPC with the same method to the same URL, or a
+    plain success if there is none left. Once the driver sets position, such answers are held on
+    the clock until it replayed the events before them, so they come in the recorded order with
+    the polls. Health and metrics are kept like for real requests, every RPC sent ends up in sent.
+    """
+
+    def __init__(self, events, **kwargs):
+        super().__init__(**kwargs)
+        self._current = {}  # url -> (data, error)
+        self._answers = collections.defaultdict(collections.deque)
+        self._responses = collections.defaultdict(collections.deque)  # url -> GET answers still to come
+        for index, (t, kind, url, data, extra) in enumerate(events):
+            if kind == 'p':
+                self._answers[(url, rpc_key(data))].append((index, extra))
+            elif kind in ('g', 'e'):
+                self._responses[url].append((index, data if kind == 'g' else None, data if kind == 'e' else None))
+        self._cond = threading.Condition()
+        self.position = None  # index of the event the driver replays, None: answer at once
+        self.polling = False
+        self.taken = set()  # indexes of GET events already answered outside a poll
+        self.sent = []
+
+    def replaying(self, index):
+        """The driver got to event index, answers recorded up to there may go out"""
+        with self._cond:
+            self.position = index
+            self._cond.notify_all()
+
+    def _hold(self, index):
+        with self._cond:
+            while self.position is not None and self.position < index:
+                self._clock.wait_until(self._cond)
+
+    def serve(self, url, index):
+        responses = self._responses[url]
+        while responses and responses[0][0] <= index:
+            _, data, error = responses.popleft()
+            self._current[url] = (data, error)
+
+    @staticmethod
+    def _raise(error):
+        if error.startswith('HTTP '):
+            return ReplayResponse(None, int(error[5:]))
+        if 'Timeout' in error.split(':', 1)[0]:
+            raise requests.exceptions.Timeout(error)
+        raise requests.exceptions.ConnectionError(error)
+
+    def _send(self, method, url, **kwargs):
+        if method == 'get':
+            if not self.polling and self._responses.get(url):
+                index, data, error = self._responses[url].popleft()
+                self.taken.add(index)
+                self._current[url] = (data, error)
+                self._hold(index)
+            elif url in self._current:
+                data, error = self._current[url]
+            else:
+                return ReplayResponse(None, 404)
+            return self._raise(error) if error else ReplayResponse(data)
+
+        payload = kwargs['json']
+        self.sent.append((url, payload))
+        answers = self._answers.get((url, rpc_key(payload)))
+        if not answers:
+            return ReplayResponse({'id': payload.get('id'), 'result': True})
+
+        index, (answer, error) = answers.popleft()
+        self._hold(index)
+        if error:
+            return self._raise(error)
+        # answers carry the ids of the recorded requests, give them the id we sent now
+        if isinstance(answer, dict):
+            answer = dict(answer, id=payload.get('id'))
+        return ReplayResponse(answer)
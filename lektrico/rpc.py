@@ -0,0 +1,30 @@
+import itertools
+import threading
+
+
+class RpcClient:
+    """JSON-RPC calls to the charger/EM over the shared HttpTransport, with monotonic request ids"""
+
+    def __init__(self, transport, src='VenusOS'):
+        self._transport = transport
+        self.src = src
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def request(self, method, params=None, src=None):
+        with self._lock:
+            request_id = next(self._ids)
+        return {'src': src or self.src, 'id': request_id, 'method': method, 'params': params or {}}
+
+    def _post(self, url, payload, timeout):
+        response = self._transport.post(url, payload, timeout=timeout)
+        response.raise_for_status()
+        json_data = response.json()
+        if not json_data:
+            raise ValueError("Converting response to JSON failed")
+        return json_data
+
+    def call(self, url, method, params=None, timeout=None, src=None):
+        """Result of one call (True for accepted settings), None if the answer has no result"""
+        payload = self.request(method, params, src)
+        return self._post(url, payload, timeout).get('result')
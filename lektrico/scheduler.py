@@ -0,0 +1,66 @@
+import random
+
+from .clock import SYSTEM_CLOCK
+
+
+class PollScheduler:
+    """Picks the next poll interval from the charger state, recent activity and failures (all in seconds)
+
+    One scheduler is shared by all chargers of the process, each charger is tracked under its own key.
+    """
+
+    def __init__(self, charging_interval=0.25, connected_interval=1.0, idle_interval=5.0,
+                 boost_interval=0.25, boost_duration=10.0, backoff_start=1.0, backoff_max=60.0, jitter=0.2,
+                 clock=SYSTEM_CLOCK):
+        self._clock = clock
+        self.configure(charging_interval, connected_interval, idle_interval,
+                       boost_interval, boost_duration, backoff_start, backoff_max, jitter)
+        self._chargers = {}
+
+    def configure(self, charging_interval, connected_interval, idle_interval,
+                  boost_interval, boost_duration, backoff_start, backoff_max, jitter):
+        self.charging_interval = charging_interval
+        self.connected_interval = connected_interval
+        self.idle_interval = idle_interval
+        self.boost_interval = boost_interval
+        self.boost_duration = boost_duration
+        self.backoff_start = backoff_start
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+
+    def _charger(self, key):
+        charger = self._chargers.get(key)
+        if charger is None:
+            charger = self._chargers[key] = {'state': None, 'failures': 0, 'boost_until': 0}
+        return charger
+
+    def boost(self, key=None):
+        """Poll fast for a while, e.g. right after a user command"""
+        self._charger(key)['boost_until'] = self._clock.monotonic() + self.boost_duration
+
+    def success(self, charger_state, key=None):
+        charger = self._charger(key)
+        if charger['state'] is not None and charger_state != charger['state']:
+            # follow state transitions (plug in, start, stop) closely
+            self.boost(key)
+        charger['state'] = charger_state
+        charger['failures'] = 0
+
+    def failure(self, key=None):
+        self._charger(key)['failures'] += 1
+
+    def next_interval(self, key=None):
+        charger = self._charger(key)
+        if charger['failures']:
+            backoff = min(self.backoff_max, self.backoff_start * 2 ** (charger['failures'] - 1))
+            # jitter so several services don't hammer a recovering host in lockstep
+            return backoff * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+        if self._clock.monotonic() < charger['boost_until']:
+            return self.boost_interval
+
+        if charger['state'] in ('C', 'D'):
+            return self.charging_interval
+        if charger['state'] == 'B':
+            return self.connected_interval
+        return self.idle_interval
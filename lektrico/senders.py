@@ -0,0 +1,62 @@
+import logging
+
+
+class DbusSenderCache:
+    """Maps unique bus names (:1.42) to well-known service names and PIDs
+
+    The map is built once and then kept current from NameOwnerChanged signals,
+    so looking up who wrote a path doesn't need any bus round-trips.
+    """
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._names = {}  # unique name -> set of well-known names it owns
+        self._pids = {}  # unique name -> pid
+        bus.add_signal_receiver(
+            self._onNameOwnerChanged, signal_name='NameOwnerChanged', dbus_interface='org.freedesktop.DBus',
+            bus_name='org.freedesktop.DBus', path='/org/freedesktop/DBus')
+        self._load()
+
+    def _load(self):
+        # imported here so the rest of the package (e.g. python -m lektrico.history) works without dbus
+        import dbus
+
+        dbus_obj = self._bus.get_object('org.freedesktop.DBus', '/org/freedesktop/DBus')
+        dbus_iface = dbus.Interface(dbus_obj, 'org.freedesktop.DBus')
+        for name in dbus_iface.ListNames():
+            if name.startswith(':'):
+                continue
+            try:
+                owner = str(dbus_iface.GetNameOwner(name))
+            except dbus.exceptions.DBusException:
+                continue  # released in the meantime
+            self._names.setdefault(owner, set()).add(str(name))
+        logging.debug("Sender cache loaded with %d names" % (sum(len(n) for n in self._names.values())))
+
+    def _onNameOwnerChanged(self, name, old_owner, new_owner):
+        name = str(name)
+        if name.startswith(':'):
+            if not new_owner:
+                # connection closed
+                self._names.pop(name, None)
+                self._pids.pop(name, None)
+            return
+
+        if old_owner:
+            owned = self._names.get(str(old_owner))
+            if owned is not None:
+                owned.discard(name)
+        if new_owner:
+            self._names.setdefault(str(new_owner), set()).add(name)
+
+    def lookup(self, sender):
+        """Returns 'name (PID:x)' or 'PID:x' for a unique bus name"""
+        sender = str(sender)
+        pid = self._pids.get(sender)
+        if pid is None:
+            pid = self._pids[sender] = self._bus.get_unix_process_id(sender)
+
+        names = self._names.get(sender)
+        if names:
+            return "%s (PID:%s)" % (sorted(names)[0], pid)
+        return "PID:%s" % pid
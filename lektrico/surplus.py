@@ -0,0 +1,110 @@
+import logging
+
+SYSTEM_SERVICE = 'com.victronenergy.system'
+
+# com.victronenergy.system paths the controller follows, the grid is the sum of the three phases
+GRID_PATHS = ('/Ac/Grid/L1/Power', '/Ac/Grid/L2/Power', '/Ac/Grid/L3/Power')
+PV_PATHS = ('/Ac/PvOnGrid/L1/Power', '/Ac/PvOnGrid/L2/Power', '/Ac/PvOnGrid/L3/Power',
+            '/Ac/PvOnOutput/L1/Power', '/Ac/PvOnOutput/L2/Power', '/Ac/PvOnOutput/L3/Power', '/Dc/Pv/Power')
+BATTERY_PATH = '/Dc/Battery/Power'
+
+
+class SystemValues:
+    """Grid, PV and battery power from com.victronenergy.system, kept current by PropertiesChanged signals
+
+    Nothing is polled: the values are read once (asynchronously) and then only updated from signals.
+    """
+
+    def __init__(self, bus):
+        self._bus = bus
+        self._values = {}
+        bus.add_signal_receiver(
+            self._onPropertiesChanged, signal_name='PropertiesChanged', dbus_interface='com.victronenergy.BusItem',
+            bus_name=SYSTEM_SERVICE, path_keyword='path')
+        self._load()
+
+    def _load(self):
+        for path in GRID_PATHS + PV_PATHS + (BATTERY_PATH,):
+            try:
+                item = self._bus.get_object(SYSTEM_SERVICE, path)
+                item.GetValue(dbus_interface='com.victronenergy.BusItem',
+                              reply_handler=lambda value, path=path: self._set(path, value),
+                              error_handler=lambda e, path=path: logging.debug("No %s: %s" % (path, e)))
+            except Exception as e:
+                logging.debug("Cannot read %s%s: %s" % (SYSTEM_SERVICE, path, e))
+
+    def _onPropertiesChanged(self, changes, path=None):
+        if 'Value' in changes:
+            self._set(str(path), changes['Value'])
+
+    def _set(self, path, value):
+        # invalid values come as an empty array
+        try:
+            self._values[path] = float(value)
+        except (TypeError, ValueError):
+            self._values.pop(path, None)
+
+    def _sum(self, paths):
+        values = [self._values[path] for path in paths if path in self._values]
+        return sum(values) if values else None
+
+    @property
+    def grid(self):
+        """Grid power in W, positive when importing, None while unknown"""
+        return self._sum(GRID_PATHS)
+
+    @property
+    def pv(self):
+        return self._sum(PV_PATHS)
+
+    @property
+    def battery(self):
+        """Battery power in W, positive while charging"""
+        return self._values.get(BATTERY_PATH)
+
+
+class SurplusController:
+    """Turns the solar surplus into a charge current (A) between the car minimum and the install current
+
+    The target follows what the charger draws now plus what goes to the grid (and, unless
+    battery_first, to the battery). Changes smaller than hysteresis (A) are ignored and the
+    setpoint moves at most ramp_up/ramp_down A per second, so clouds don't make it hunt.
+    """
+
+    def __init__(self, hysteresis=1.0, ramp_up=1.0, ramp_down=4.0, battery_first=True):
+        self.configure(hysteresis, ramp_up, ramp_down, battery_first)
+        self._setpoint = None
+        self._last = None
+
+    def configure(self, hysteresis, ramp_up, ramp_down, battery_first):
+        self.hysteresis = hysteresis
+        self.ramp_up = ramp_up
+        self.ramp_down = ramp_down
+        self.battery_first = battery_first
+
+    def reset(self):
+        self._setpoint = None
+        self._last = None
+
+    def target(self, system, charger_power, current, voltage, phases, min_current, max_current, now):
+        """New dynamic_current in A, or None while the grid power is unknown"""
+        grid = system.grid
+        if grid is None or not voltage:
+            return None
+
+        available = charger_power - grid
+        battery = system.battery
+        if not self.battery_first and battery is not None and battery > 0:
+            available += battery
+        wanted = max(min_current, min(max_current, available / (voltage * phases)))
+
+        if self._setpoint is None:
+            self._setpoint = float(current)
+        elapsed = now - self._last if self._last is not None else 1.0
+        self._last = now
+
+        if abs(wanted - self._setpoint) >= self.hysteresis:
+            step = (self.ramp_up if wanted > self._setpoint else self.ramp_down) * elapsed
+            self._setpoint += max(-step, min(step, wanted - self._setpoint))
+
+        return int(max(min_current, min(max_current, self._setpoint)))
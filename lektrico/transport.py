@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .clock import SYSTEM_CLOCK
+from .health import HostHealth, HostOffline
+from .metrics import Metrics
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+class HttpTransport:
+    """Shared HTTP transport with one keep-alive session, health and RPC stats per host (charger, EM)"""
+
+    def __init__(self, pool_size=2, connect_timeout=2.0, read_timeout=5.0, health=None, clock=SYSTEM_CLOCK):
+        self._pool_size = pool_size
+        self._clock = clock
+        self._timeout = (connect_timeout, read_timeout)
+        self._health_settings = health or {}
+        self._sessions = {}
+        self._health = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.recorder = None  # Recorder while config.ini [RECORD] Path is set
+
+    def _session(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                logging.debug("Opening HTTP session for %s (pool size %d)" % (host, self._pool_size))
+                session = requests.Session()
+                # The embedded web servers are small, so keep few connections and never retry on our own
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_size, max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+            return session
+
+    def health(self, host):
+        """HostHealth of a host ('ip' or 'ip:port'), every request to it is counted there"""
+        with self._lock:
+            health = self._health.get(host)
+            if health is None:
+                health = self._health[host] = HostHealth(host, clock=self._clock, **self._health_settings)
+            return health
+
+    def metrics(self, host):
+        """Latency/error stats of the requests to a host, by RPC name"""
+        with self._lock:
+            metrics = self._metrics.get(host)
+            if metrics is None:
+                metrics = self._metrics[host] = Metrics()
+            return metrics
+
+    def configure(self, pool_size, connect_timeout, read_timeout, health=None):
+        """Apply new settings, existing sessions are dropped and reopened on next use"""
+        self._pool_size = pool_size
+        self._timeout = (connect_timeout, read_timeout)
+        if health is not None:
+            self._health_settings = health
+            with self._lock:
+                for hostHealth in self._health.values():
+                    hostHealth.configure(**health)
+        self.close()
+
+    def get(self, url, timeout=None):
+        # charger_info, charger_config, app_config
+        name = url.rsplit('/', 1)[-1].replace('.get', '')
+        return self._request(name, 'get', url, timeout=timeout or self._timeout)
+
+    def post(self, url, json, timeout=None):
+        # dynamic_current.set, charge.start, app_config.set, ...
+        name = json.get('method', 'rpc') if isinstance(json, dict) else 'rpc'
+        return self._request(name, 'post', url, json=json, timeout=timeout or self._timeout)
+
+    def _send(self, method, url, **kwargs):
+        return getattr(self._session(url), method)(url, **kwargs)
+
+    def _request(self, name, method, url, **kwargs):
+        # don't spend sockets and timeouts on a host that is known to be down
+        host = urlsplit(url).netloc
+        health = self.health(host)
+        metrics = self.metrics(host)
+        if not health.allow():
+            raise HostOffline("%s is offline, next probe in %.0fs" % (health.host, health.retry_in()))
+
+        start = time.monotonic()
+        recorder = self.recorder
+        try:
+            response = self._send(method, url, **kwargs)
+        except requests.exceptions.Timeout as e:
+            health.failure()
+            metrics.incr(name + '.timeouts')
+            if recorder is not None:
+                recorder.request(url, kwargs.get('json'), error=e)
+            raise
+        except Exception as e:
+            health.failure()
+            metrics.incr(name + '.errors')
+            if recorder is not None:
+                recorder.request(url, kwargs.get('json'), error=e)
+            raise
+        finally:
+            metrics.observe(name, time.monotonic() - start)
+
+        if recorder is not None:
+            recorder.request(url, kwargs.get('json'), response=response)
+
+        # any answer means the host is reachable, HTTP errors are up to the caller
+        health.success()
+        return response
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
@@ -0,0 +1,259 @@
+"""CommandQueue coalescing and rate limit, and how the service queues writes around a restart
+
+The service tests run against bench/simulator.py with the stand-ins from bench/stubs.py.
+
+    python -m pytest tests
+"""
+
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'bench'))
+
+import stubs
+from benchmark import loadService
+from simulator import LektricoSimulator
+
+from lektrico import Command, CommandQueue, CommandTimeout, SnapshotWaiter
+
+CONFIG_TEMPLATE = """[DEFAULT]
+AccessType=OnPremise
+SignOfLifeLog=0
+Deviceinstance=43
+HardwareVersion=1
+
+[ONPREMISE]
+Host=%(host)s
+EM_Host=%(em_host)s
+Push=off
+StaticCache=
+CurrentWriteInterval=0
+
+[POLLING]
+ChargingInterval=100
+ConnectedInterval=100
+IdleInterval=5000
+BoostInterval=50
+
+[SURPLUS]
+Enabled=%(surplus)d
+RampUp=100
+RampDown=100
+
+[HISTORY]
+Path=
+"""
+
+
+class CommandQueueTest(unittest.TestCase):
+    """The queue on its own, outcomes are delivered to the test instead of a main loop"""
+
+    def setUp(self):
+        self._idle = queue.Queue()
+        self.started = []
+        self.commands = CommandQueue(lambda callback, *args: self._idle.put((callback, args)), self._onDone,
+                                     min_interval=0)
+        self.done = []
+
+    def _onDone(self, command, result, error):
+        self.done.append((command, result, error))
+
+    def _run(self, path, value, timeout=5.0, coalesce=False, block=None):
+        def run(command):
+            self.started.append((command.path, command.value, time.monotonic()))
+            if block is not None:
+                block.wait(5.0)
+            return {'result': True}
+        return Command(path, value, run, timeout, coalesce=coalesce)
+
+    def _waitStarted(self, count):
+        end = time.monotonic() + 5.0
+        while len(self.started) < count and time.monotonic() < end:
+            time.sleep(0.01)
+
+    def _waitDone(self, count):
+        while len(self.done) < count:
+            callback, args = self._idle.get(timeout=5.0)
+            callback(*args)
+
+    def test_burst_is_coalesced_into_the_queued_command(self):
+        block = threading.Event()
+        self.assertIsNone(self.commands.submit(self._run('/Mode', 1, block=block)))
+        queued = self._run('/SetCurrent', 10, coalesce=True)
+        self.assertIsNone(self.commands.submit(queued))
+        self.assertIs(self.commands.submit(self._run('/SetCurrent', 11, coalesce=True)), queued)
+        self.assertIs(self.commands.submit(self._run('/SetCurrent', 12, coalesce=True)), queued)
+        block.set()
+
+        self._waitDone(2)
+        self.assertEqual([(path, value) for path, value, _ in self.started], [('/Mode', 1), ('/SetCurrent', 12)])
+        self.assertEqual(queued.merged, 2)
+        self.assertTrue(self._idle.empty())
+
+    def test_other_paths_keep_their_order(self):
+        block = threading.Event()
+        self.commands.submit(self._run('/SetCurrent', 10, coalesce=True, block=block))
+        self._waitStarted(1)
+        self.commands.submit(self._run('/StartStop', 0))
+        self.assertIsNone(self.commands.submit(self._run('/SetCurrent', 11, coalesce=True)))
+        self.commands.submit(self._run('/StartStop', 1))
+        block.set()
+
+        self._waitDone(4)
+        self.assertEqual([(path, value) for path, value, _ in self.started],
+                         [('/SetCurrent', 10), ('/StartStop', 0), ('/SetCurrent', 11), ('/StartStop', 1)])
+
+    def test_coalescing_writes_are_rate_limited(self):
+        self.commands.min_interval = 0.3
+        self.commands.submit(self._run('/SetCurrent', 10, coalesce=True))
+        self._waitDone(1)
+        self.commands.submit(self._run('/SetCurrent', 11, coalesce=True))
+        self.commands.submit(self._run('/StartStop', 0))
+        self._waitDone(3)
+
+        # the write waits out the interval, later ones are not held up behind it for long
+        starts = dict(((path, value), t) for path, value, t in self.started)
+        self.assertGreaterEqual(starts[('/SetCurrent', 11)] - starts[('/SetCurrent', 10)], 0.29)
+        self.assertEqual([(path, value) for path, value, _ in self.started][-1], ('/StartStop', 0))
+
+    def test_expired_command_is_not_run(self):
+        block = threading.Event()
+        self.commands.submit(self._run('/Mode', 1, block=block))
+        late = self._run('/StartStop', 0, timeout=0.1)
+        self.commands.submit(late)
+        time.sleep(0.2)
+        block.set()
+
+        self._waitDone(2)
+        command, result, error = self.done[1]
+        self.assertIs(command, late)
+        self.assertIsInstance(error, CommandTimeout)
+        self.assertEqual(len(self.started), 1)
+
+
+class SnapshotWaiterTest(unittest.TestCase):
+
+    def test_waits_for_a_matching_snapshot_after_since(self):
+        waiter = SnapshotWaiter()
+        waiter.publish({'dynamic_current': 16}, 1.0)
+        threading.Timer(0.1, waiter.publish, [{'dynamic_current': 10}, 3.0]).start()
+        data = waiter.wait(2.0, lambda data: data['dynamic_current'] == 10, timeout=2.0)
+        self.assertEqual(data, {'dynamic_current': 10})
+        self.assertIsNone(waiter.wait(4.0, timeout=0.1))
+
+    def test_cancel_ends_the_wait_until_reset(self):
+        waiter = SnapshotWaiter()
+        threading.Timer(0.1, waiter.cancel).start()
+        start = time.monotonic()
+        self.assertIsNone(waiter.wait(0, timeout=5.0))
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertIsNone(waiter.wait(0, timeout=5.0))
+
+        waiter.reset()
+        waiter.publish({'dynamic_current': 10}, 1.0)
+        self.assertEqual(waiter.wait(0, timeout=0.1), {'dynamic_current': 10})
+
+
+class ServiceWriteTest(unittest.TestCase):
+    """Writes from VRM/GX while the charger pauses and restarts after a change"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='lektrico-test-')
+        self.em = LektricoSimulator().start()
+        self.charger = None
+
+    def tearDown(self):
+        if self.charger is not None:
+            self.charger.stop()
+        self.em.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _start(self, pause_after=None, surplus=False):
+        self.charger = LektricoSimulator(pause_after=pause_after).start()
+        configfile = os.path.join(self.workdir, 'config.ini')
+        with open(configfile, 'w') as f:
+            f.write(CONFIG_TEMPLATE % {'host': self.charger.host, 'em_host': self.em.host, 'surplus': surplus})
+        self.loop = stubs.FakeMainLoop(run_timers=True)
+        module = loadService(self.loop)
+        self.hub = module.DbusLektricoHub('com.victronenergy.evcharger', module.getDbusPaths(), configfile=configfile)
+        self.service = list(self.hub.services.values())[0]
+        self.dbus = self.service._dbusservice
+        self.assertTrue(self.loop.run_until(lambda: self.dbus['/StartStop'] == 1, timeout=5.0))
+        self.charger.rpcs[:] = []
+
+    def _methods(self):
+        return [rpc.get('method') for rpc in self.charger.rpcs]
+
+    def _settle(self):
+        self.assertTrue(self.loop.run_until(lambda: not self.service._pendingCommands, timeout=15.0))
+        self.loop.run_for(0.5)
+
+    def test_stop_during_restart_is_sent(self):
+        self._start(pause_after=0.3)
+        self.assertTrue(self.dbus.setFromDbus('/SetCurrent', 10))
+        self.assertTrue(self.loop.run_until(lambda: self.charger.charger_info['charger_state'] == 'B', timeout=5.0))
+        self.assertTrue(self.dbus.setFromDbus('/StartStop', 0))
+        self._settle()
+
+        self.assertEqual(self._methods()[-1], 'charge.stop')
+        self.assertEqual(self.charger.charger_info['charger_state'], 'B')
+        self.assertEqual(self.dbus['/StartStop'], 0)
+
+    def test_queued_stop_skips_the_restart(self):
+        # no pause comes, the restart would be watched for the whole PAUSE_WINDOW
+        self._start()
+        self.dbus.setFromDbus('/SetCurrent', 10)
+        self.dbus.setFromDbus('/StartStop', 0)
+        start = time.monotonic()
+        self._settle()
+
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(self._methods(), ['dynamic_current.set', 'charge.stop'])
+        self.assertEqual(self.dbus['/StartStop'], 0)
+
+    def test_restart_after_a_pause(self):
+        self._start(pause_after=0.3)
+        self.dbus.setFromDbus('/SetCurrent', 10)
+        self._settle()
+
+        self.assertEqual(self._methods(), ['dynamic_current.set', 'charge.start'])
+        self.assertEqual(self.charger.charger_info['charger_state'], 'C')
+        self.assertEqual(self.dbus['/StartStop'], 1)
+
+    def test_repeated_write_is_not_sent(self):
+        # a script re-writing the setpoint the charger already has neither sends it nor boosts polling
+        self._start()
+        scheduler, name = self.service._scheduler, self.service._name
+        current = self.dbus['/SetCurrent']
+        self.assertTrue(self.dbus.setFromDbus('/SetCurrent', current))
+        self.assertEqual(self.service._pendingCommands, {})
+        self.assertEqual(scheduler.next_interval(name), scheduler.charging_interval)
+
+        self.assertTrue(self.dbus.setFromDbus('/SetCurrent', current - 1))
+        self.assertEqual(scheduler.next_interval(name), scheduler.boost_interval)
+        self._settle()
+        self.assertEqual(self._methods(), ['dynamic_current.set'])
+
+    def test_surplus_step_restarts_charging(self):
+        self._start(pause_after=0.3, surplus=True)
+        self.hub.systemValues = types.SimpleNamespace(grid=-2000.0, pv=4000.0, battery=0.0)
+        self.assertTrue(self.loop.run_until(lambda: 'dynamic_current.set' in self._methods(), timeout=5.0))
+        self._settle()
+
+        self.assertEqual(self._methods(), ['dynamic_current.set', 'charge.start'])
+        self.assertEqual(self.charger.charger_info['charger_state'], 'C')
+        self.assertEqual(self.dbus['/StartStop'], 1)
+        self.assertGreater(self.dbus['/SetCurrent'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""HostHealth, the circuit breaker per host, on a clock the test moves by hand
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from lektrico.clock import Clock
+from lektrico.health import DEGRADED, OFFLINE, ONLINE, PROBING, UNKNOWN, HostHealth
+
+
+class ManualClock(Clock):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class HostHealthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = ManualClock()
+        self.health = HostHealth('charger', failure_threshold=3, probe_interval=10.0, probe_max=40.0, jitter=0,
+                                 clock=self.clock)
+
+    def _fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.health.allow())
+            self.health.failure()
+
+    def test_unknown_until_first_answer(self):
+        self.assertEqual(self.health.state, UNKNOWN)
+        self.assertFalse(self.health.connected)
+        self.assertTrue(self.health.allow())
+        self.health.success()
+        self.assertEqual(self.health.state, ONLINE)
+        self.assertTrue(self.health.connected)
+
+    def test_failures_degrade_then_open_the_circuit(self):
+        self.health.success()
+        self._fail(1)
+        self.assertEqual(self.health.state, DEGRADED)
+        self.assertTrue(self.health.connected)
+        self._fail(2)
+        self.assertEqual(self.health.state, OFFLINE)
+        self.assertFalse(self.health.connected)
+        self.assertFalse(self.health.allow())
+        self.assertEqual(self.health.retry_in(), 10.0)
+
+    def test_unknown_host_goes_offline_without_degrading(self):
+        self._fail(2)
+        self.assertEqual(self.health.state, UNKNOWN)
+        self._fail(1)
+        self.assertEqual(self.health.state, OFFLINE)
+
+    def test_success_resets_the_failure_count(self):
+        self.health.success()
+        self._fail(2)
+        self.health.success()
+        self._fail(2)
+        self.assertEqual(self.health.state, DEGRADED)
+
+    def test_one_probe_after_probe_interval(self):
+        self._fail(3)
+        self.clock.now += 9.9
+        self.assertFalse(self.health.allow())
+        self.clock.now += 0.1
+        self.assertTrue(self.health.allow())
+        self.assertEqual(self.health.state, PROBING)
+        self.assertFalse(self.health.allow())
+        self.health.success()
+        self.assertEqual(self.health.state, ONLINE)
+        self.assertEqual(self.health.failures, 0)
+
+    def test_failed_probes_back_off_up_to_probe_max(self):
+        self._fail(3)
+        for delay in (20.0, 40.0, 40.0):
+            self.clock.now += self.health.retry_in()
+            self.assertTrue(self.health.allow())
+            self.health.failure()
+            self.assertEqual(self.health.state, OFFLINE)
+            self.assertEqual(self.health.retry_in(), delay)
+
+        # back online, the next outage starts at probe_interval again
+        self.clock.now += self.health.retry_in()
+        self.assertTrue(self.health.allow())
+        self.health.success()
+        self._fail(3)
+        self.assertEqual(self.health.retry_in(), 10.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""SessionHistory: the tick ring in RAM, the 1 s/1 min tiers and reopening the file in /data
+
+    python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from lektrico import SessionHistory
+
+START = 1700000000.0
+
+
+class SessionHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='lektrico-test-')
+        self.path = os.path.join(self.workdir, 'history-default.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _charge(self, history, session_id, seconds, start=START, power=2300.0):
+        # four ticks per second, energy counts up like the charger's session_energy
+        for tick in range(seconds * 4):
+            t = start + tick / 4.0
+            history.add(t, session_id, power, power / 230.0, (t - start) * power / 3600.0)
+
+    def test_tick_ring_keeps_the_latest(self):
+        history = SessionHistory(None, ticks=10)
+        self._charge(history, 1, 5)
+        ticks = list(history.ticks())
+        self.assertEqual(len(ticks), 10)
+        self.assertEqual(ticks[-1][0], START + 19 / 4.0)
+        self.assertEqual(ticks[0][0], START + 10 / 4.0)
+
+    def test_tiers_wrap_and_sessions_stay_apart(self):
+        history = SessionHistory(None, seconds=30, minutes=10)
+        self._charge(history, 1, 20)
+        self._charge(history, 2, 20, start=START + 20)
+        history.flush()
+
+        sessions = history.sessions()
+        self.assertEqual(sorted(sessions), [1, 2])
+        # the 1 s tier only holds the last 30 samples, session 1 lost its first seconds there
+        session = history.session(2)
+        self.assertEqual(session['resolution'], 1)
+        self.assertEqual(len(session['power']), 19)
+        self.assertEqual(session['power'][0], (START + 20, 2300.0))
+        self.assertIsNone(history.session(3))
+
+    def test_reopen_keeps_flushed_samples(self):
+        history = SessionHistory(self.path, seconds=60, minutes=10)
+        self._charge(history, 7, 10)
+        history.close()
+
+        reopened = SessionHistory(self.path, seconds=60, minutes=10)
+        self.assertEqual(list(reopened.sessions()), [7])
+        self.assertEqual(len(reopened.session(7)['power']), 10)
+        self.assertEqual(list(reopened.ticks()), [])
+        reopened.close()
+
+    def test_other_layout_starts_over(self):
+        history = SessionHistory(self.path, seconds=60, minutes=10)
+        self._charge(history, 7, 10)
+        history.close()
+
+        resized = SessionHistory(self.path, seconds=120, minutes=10)
+        self.assertEqual(resized.sessions(), {})
+        self._charge(resized, 8, 10)
+        resized.close()
+        self.assertEqual(os.path.getsize(self.path), len(SessionHistory(None, seconds=120, minutes=10)._buffer))
+
+        # the new layout is kept from now on
+        again = SessionHistory(self.path, seconds=120, minutes=10)
+        self.assertEqual(list(again.sessions()), [8])
+        again.close()
+
+    def test_samples_reach_the_file_only_when_flushed(self):
+        history = SessionHistory(self.path, seconds=60, minutes=10, flush_interval=3600)
+        self._charge(history, 7, 10)
+        self.assertIn(7, history.sessions())  # pending samples are part of the answer
+
+        with open(self.path, 'rb') as f:
+            before = f.read()
+        history.flush()
+        with open(self.path, 'rb') as f:
+            self.assertNotEqual(f.read(), before)
+        history.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""RepeatFilter: repeated warnings/errors are written once per window and summed up when it ends
+
+    python -m pytest tests
+"""
+
+import logging
+import os
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from lektrico.logs import RepeatFilter
+
+
+def record(msg, created, level=logging.WARNING, exc=None):
+    entry = logging.makeLogRecord({'name': 'root', 'levelno': level, 'levelname': logging.getLevelName(level),
+                                   'msg': msg, 'exc_info': (type(exc), exc, None) if exc else None})
+    entry.created = created
+    return entry
+
+
+class RepeatFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = RepeatFilter(window=60.0)
+
+    def test_repeats_within_the_window_are_counted(self):
+        self.assertTrue(self.filter.check(record("charger offline", 0)))
+        for t in range(1, 10):
+            self.assertFalse(self.filter.check(record("charger offline", t)))
+        self.assertEqual(self.filter.expired(59), [])
+
+        summaries = self.filter.expired(60)
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0].getMessage(), "charger offline [repeated 9 times in 60s]")
+        self.assertEqual(summaries[0].levelno, logging.WARNING)
+        self.assertEqual(self.filter.expired(120), [])
+
+    def test_written_again_after_the_window(self):
+        self.assertTrue(self.filter.check(record("charger offline", 0)))
+        self.assertTrue(self.filter.check(record("charger offline", 60)))
+
+    def test_no_summary_without_repeats(self):
+        self.filter.check(record("charger offline", 0))
+        self.assertEqual(self.filter.expired(60), [])
+
+    def test_different_messages_and_levels_pass(self):
+        self.assertTrue(self.filter.check(record("charger offline", 0)))
+        self.assertTrue(self.filter.check(record("EM offline", 1)))
+        self.assertTrue(self.filter.check(record("charger offline", 2, level=logging.ERROR)))
+        self.assertTrue(self.filter.check(record("polling", 3, level=logging.INFO)))
+        self.assertTrue(self.filter.check(record("polling", 4, level=logging.INFO)))
+
+    def test_exception_text_is_part_of_the_key(self):
+        self.assertTrue(self.filter.check(record("Error fetching", 0, exc=ValueError("a"))))
+        self.assertTrue(self.filter.check(record("Error fetching", 1, exc=ValueError("b"))))
+        self.assertFalse(self.filter.check(record("Error fetching", 2, exc=ValueError("a"))))
+
+    def test_window_zero_writes_everything(self):
+        self.filter.window = 0
+        self.assertTrue(self.filter.check(record("charger offline", 0)))
+        self.assertTrue(self.filter.check(record("charger offline", 1)))
+
+    def test_flush_sums_up_open_windows(self):
+        self.filter.check(record("charger offline", 0))
+        self.filter.check(record("charger offline", 1))
+        self.filter.check(record("EM offline", 2))
+        summaries = self.filter.flush(10)
+        self.assertEqual([summary.getMessage() for summary in summaries],
+                         ["charger offline [repeated 1 times in 10s]"])
+        self.assertTrue(self.filter.check(record("charger offline", 11)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+"""PushChannel and the polling fallback, against bench/simulator.py with and without a push channel
+
+Runs without a GX: the service script is loaded with the stand-ins from bench/stubs.py.
+
+    python -m pytest tests
+"""
+
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'bench'))
+
+import stubs
+from benchmark import loadService
+from simulator import LektricoSimulator
+
+from lektrico import PushChannel, PushNotSupported
+
+CONFIG_TEMPLATE = """[DEFAULT]
+AccessType=OnPremise
+SignOfLifeLog=0
+Deviceinstance=43
+HardwareVersion=1
+
+[ONPREMISE]
+Host=%(host)s
+EM_Host=%(em_host)s
+Push=on
+PushKeepalive=0.5
+StaticCache=%(static)s
+
+[POLLING]
+ConnectedInterval=200
+IdleInterval=200
+PushInterval=60000
+
+[HISTORY]
+Path=
+"""
+
+
+class PushChannelTest(unittest.TestCase):
+    """The channel on its own, callbacks are run by the test instead of a main loop"""
+
+    def setUp(self):
+        self.simulator = None
+        self.channel = None
+        self._idle = queue.Queue()
+        self.snapshots = []
+        self.closed = []
+
+    def tearDown(self):
+        if self.channel is not None:
+            self.channel.stop()
+        if self.simulator is not None:
+            self.simulator.stop()
+
+    def _open(self, push):
+        self.simulator = LektricoSimulator(push=push).start()
+        self.channel = PushChannel(self.simulator.host, lambda callback, *args: self._idle.put((callback, args)),
+                                   self.snapshots.append, self.closed.append, keepalive=0.5).start()
+
+    def _runUntil(self, condition, timeout=5.0):
+        end = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > end:
+                self.fail("timed out")
+            try:
+                callback, args = self._idle.get(timeout=0.05)
+            except queue.Empty:
+                continue
+            callback(*args)
+
+    def test_notify_status_merges_into_snapshot(self):
+        self._open(push=True)
+        self._runUntil(lambda: self.snapshots)
+        first = self.snapshots[-1]
+        self.assertEqual(first, self.simulator.charger_info)
+
+        self.simulator.update({'charger_state': 'B', 'instant_power': 0})
+        self._runUntil(lambda: self.snapshots[-1].get('charger_state') == 'B')
+        merged = self.snapshots[-1]
+        self.assertEqual(merged['instant_power'], 0)
+        self.assertEqual(merged['fw_version'], first['fw_version'])
+        self.assertEqual(set(merged), set(first))
+        self.assertEqual(self.simulator.counts.get('ws:charger_info.get'), 1)
+        self.assertEqual(self.closed, [])
+
+    def test_no_websocket_is_push_not_supported(self):
+        self._open(push=False)
+        self._runUntil(lambda: self.closed)
+        self.assertIsInstance(self.closed[0], PushNotSupported)
+        self.assertEqual(self.snapshots, [])
+
+    def test_unanswered_keepalive_closes_channel(self):
+        self._open(push=True)
+        self._runUntil(lambda: self.snapshots)
+        self.simulator.push_hung = True
+        self._runUntil(lambda: self.closed, timeout=3.0)
+        self.assertIsInstance(self.closed[0], ConnectionError)
+        self.assertNotIsInstance(self.closed[0], PushNotSupported)
+
+    def test_dropped_channel_is_reported(self):
+        self._open(push=True)
+        self._runUntil(lambda: self.snapshots)
+        self.simulator.stop()
+        self.simulator = None
+        self._runUntil(lambda: self.closed)
+        self.assertNotIsInstance(self.closed[0], PushNotSupported)
+
+
+class PushFallbackTest(unittest.TestCase):
+    """The service polls charger_info again whenever the push channel is gone"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='lektrico-test-')
+        self.em = LektricoSimulator().start()
+        self.charger = None
+        self.service = None
+
+    def tearDown(self):
+        if self.service is not None and self.service._push is not None:
+            self.service._push.stop()
+        if self.charger is not None:
+            self.charger.stop()
+        self.em.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def _start(self, push):
+        self.charger = LektricoSimulator(push=push).start()
+        configfile = os.path.join(self.workdir, 'config.ini')
+        with open(configfile, 'w') as f:
+            f.write(CONFIG_TEMPLATE % {'host': self.charger.host, 'em_host': self.em.host,
+                                       'static': os.path.join(self.workdir, 'static.json')})
+        self.loop = stubs.FakeMainLoop(run_timers=True)
+        module = loadService(self.loop)
+        hub = module.DbusLektricoHub('com.victronenergy.evcharger', module.getDbusPaths(), configfile=configfile)
+        self.service = list(hub.services.values())[0]
+
+    def _polls(self):
+        return self.charger.counts.get('/rpc/charger_info.get', 0)
+
+    def _assertPolling(self):
+        polls = self._polls()
+        self.assertTrue(self.loop.run_until(lambda: self._polls() >= polls + 3, timeout=5.0),
+                        "charger_info is not polled")
+
+    def test_push_not_supported_falls_back_to_polling(self):
+        self._start(push=False)
+        self.assertTrue(self.loop.run_until(lambda: self.service._pushRetryTimer is not None, timeout=5.0))
+        self.assertFalse(self.service._pushActive)
+        self.assertEqual(self.service._static.get('push_unsupported'), self.charger.charger_info['fw_version'])
+        self._assertPolling()
+
+    def test_push_replaces_polling(self):
+        self._start(push=True)
+        self.assertTrue(self.loop.run_until(lambda: self.service._pushActive, timeout=5.0))
+        self.charger.update({'charger_state': 'B', 'instant_power': 0})
+        self.assertTrue(self.loop.run_until(lambda: self.service._dbusservice['/Status'] == 1, timeout=5.0))
+        self.assertEqual(self.service._dbusservice['/Ac/Power'], 0)
+        polls = self._polls()
+        self.loop.run_for(1.0)
+        self.assertLessEqual(self._polls(), polls + 1)
+
+    def test_dropped_channel_falls_back_to_polling(self):
+        self._start(push=True)
+        self.assertTrue(self.loop.run_until(lambda: self.service._pushActive, timeout=5.0))
+        self.charger.push_hung = True
+        self.assertTrue(self.loop.run_until(lambda: self.service._pushRetryTimer is not None, timeout=5.0))
+        self.assertFalse(self.service._pushActive)
+        self.assertIsNone(self.service._static.get('push_unsupported'))
+        self._assertPolling()
+
+
+if __name__ == '__main__':
+    unittest.main()